@@ -0,0 +1,121 @@
+import argparse
+import json
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+from benchmarks.mock_spotify import MockSpotifyServer, MockSpotifyState
+from discoverindefinitely import backup
+from discoverindefinitely.database import DatabaseClient
+
+DEFAULT_SIZES = [100, 1000, 5000, 10000, 50000]
+
+
+def seed_database(database_path):
+    """
+    Stores an access and refresh token in the database at `database_path` so that the client skips the interactive
+    authorisation flow.
+
+    :param database_path:
+    """
+    db_client = DatabaseClient(database_path)
+    db_client.set_many({
+        'access_token': 'benchmark-access-token',
+        'refresh_token': 'benchmark-refresh-token'
+    })
+    db_client.close()
+
+
+def run_backup(server, application_config):
+    """
+    Runs `backup.main` against `server` and returns the request statistics recorded by the server along with the run's
+    wall time.
+
+    :param server:
+    :param application_config:
+    :return:
+    """
+    server.state.reset_stats()
+    output = StringIO()
+    start = time.perf_counter()
+
+    with redirect_stdout(output):
+        backup.main(application_config)
+
+    wall_time = time.perf_counter() - start
+
+    with server.state.lock:
+        stats = json.loads(json.dumps(server.state.stats))
+
+    stats['wall_time'] = round(wall_time, 3)
+    return stats
+
+
+def benchmark(destination_size, args):
+    """
+    Benchmarks a cold run, with an empty local database, followed by a warm run against the same database for a
+    destination playlist of `destination_size` tracks.
+
+    :param destination_size:
+    :param args:
+    :return:
+    """
+    state = MockSpotifyState(destination_size, source_size=args.source_size, latency=args.latency,
+                             rate_limit_every=args.rate_limit_every, expire_token_every=args.expire_token_every)
+
+    with tempfile.TemporaryDirectory() as directory, MockSpotifyServer(state) as server:
+        database_path = Path(directory) / 'db.sqlite'
+        seed_database(database_path)
+        application_config = {
+            'client_id': 'benchmark-client-id',
+            'client_secret': 'benchmark-client-secret',
+            'destination_playlist': 'Backups',
+            'api_url': f'{server.url}v1/',
+            'accounts_url': server.url,
+            'database_path': str(database_path),
+            'requests_per_second': args.requests_per_second
+        }
+
+        return {
+            'destination_size': destination_size,
+            'cold': run_backup(server, application_config),
+            'warm': run_backup(server, application_config)
+        }
+
+
+def print_results(results):
+    """
+    Prints a summary table of the benchmark results.
+
+    :param results:
+    """
+    print(f'{"destination":>12} {"run":>5} {"requests":>9} {"bytes sent":>12} {"bytes recv":>11} {"429s":>5} '
+          f'{"401s":>5} {"wall time":>10}')
+
+    for result in results:
+        for run in ('cold', 'warm'):
+            stats = result[run]
+            print(f'{result["destination_size"]:>12} {run:>5} {stats["requests"]:>9} {stats["bytes_sent"]:>12} '
+                  f'{stats["bytes_received"]:>11} {stats["rate_limited"]:>5} {stats["tokens_expired"]:>5} '
+                  f'{stats["wall_time"]:>9.3f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark a backup run against a local mock Spotify API')
+    parser.add_argument('-s', '--sizes', help='Destination playlist sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--source-size', help='Tracks in each source playlist', type=int, default=30)
+    parser.add_argument('--latency', help='Mock API latency in seconds', type=float, default=0)
+    parser.add_argument('--rate-limit-every', help='Respond 429 to every Nth API request', type=int, default=0)
+    parser.add_argument('--expire-token-every', help='Respond 401 to every Nth API request', type=int, default=0)
+    parser.add_argument('--requests-per-second', help='Client request budget', type=float, default=1000)
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = [benchmark(size, args) for size in args.sizes]
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
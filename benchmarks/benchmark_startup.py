@@ -0,0 +1,45 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+COMMANDS = {
+    'interpreter': ['-c', 'pass'],
+    'import backup': ['-c', 'import discoverindefinitely.backup'],
+    'backup --help': ['-m', 'discoverindefinitely.backup', '--help'],
+    'create client': ['-c', 'from discoverindefinitely.spotify import SpotifyClient; SpotifyClient("id", "secret")']
+}
+
+
+def time_command(arguments, repeat):
+    """
+    Runs the Python interpreter with `arguments` in a fresh process `repeat` times and returns the wall time of each
+    run.
+
+    :param arguments:
+    :param repeat:
+    :return:
+    """
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *arguments], cwd=REPOSITORY_ROOT, stdout=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the start up time of the backup command')
+    parser.add_argument('-r', '--repeat', help='Number of runs of each command', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f'{"command":<15} {"min":>9} {"median":>9}')
+
+    for name, arguments in COMMANDS.items():
+        timings = time_command(arguments, args.repeat)
+        print(f'{name:<15} {min(timings) * 1000:>7.1f}ms {statistics.median(timings) * 1000:>7.1f}ms')
@@ -0,0 +1,391 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BASE62_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+USER_ID = 'benchmark-user'
+
+
+def make_track_id(rng):
+    """
+    Generates a random 22 character base62 track ID in the same format as those used by Spotify.
+
+    :param rng:
+    :return:
+    """
+    value = rng.getrandbits(128)
+    characters = []
+
+    for _ in range(22):
+        value, remainder = divmod(value, 62)
+        characters.append(BASE62_ALPHABET[remainder])
+
+    return ''.join(reversed(characters))
+
+
+def make_track(track_id, fields):
+    """
+    Builds a track object for `track_id`. If a field query was sent with the request only the track's ID and URI are
+    returned, otherwise a track object with nested album and artist objects similar in size to those returned by the
+    Spotify API is returned.
+
+    :param track_id:
+    :param fields:
+    :return:
+    """
+    uri = f'spotify:track:{track_id}'
+
+    if fields is not None:
+        track = {'id': track_id}
+
+        if 'uri' in fields:
+            track['uri'] = uri
+
+        return track
+
+    artist = {
+        'id': track_id[::-1],
+        'name': f'Artist {track_id[:4]}',
+        'type': 'artist',
+        'uri': f'spotify:artist:{track_id[::-1]}',
+        'external_urls': {'spotify': f'https://open.spotify.com/artist/{track_id[::-1]}'}
+    }
+
+    return {
+        'id': track_id,
+        'name': f'Track {track_id[:6]}',
+        'uri': uri,
+        'type': 'track',
+        'duration_ms': 200000,
+        'explicit': False,
+        'popularity': 50,
+        'is_local': False,
+        'artists': [artist],
+        'album': {
+            'id': track_id[1:] + '0',
+            'name': f'Album {track_id[:5]}',
+            'album_type': 'album',
+            'release_date': '2020-01-01',
+            'artists': [artist],
+            'images': [{'url': f'https://i.scdn.co/image/{track_id}', 'height': size, 'width': size}
+                       for size in (640, 300, 64)]
+        },
+        'external_ids': {'isrc': f'GB{track_id[:10].upper()}'},
+        'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'}
+    }
+
+
+class MockSpotifyState:
+    def __init__(self, destination_size, source_size=30, destination_name='Backups', latency=0, rate_limit_every=0,
+                 expire_token_every=0, seed=0):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.expire_token_every = expire_token_every
+        self.lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'bytes_sent': 0,
+            'bytes_received': 0,
+            'rate_limited': 0,
+            'tokens_expired': 0,
+            'endpoints': {}
+        }
+        self.refresh_token_revoked = False
+        self._api_requests = 0
+        self._token_counter = 0
+        self._playlist_counter = 0
+        self.playlists = {}
+        rng = random.Random(seed)
+        destination_tracks = [make_track_id(rng) for _ in range(destination_size)]
+
+        # Half of each source playlist has already been backed up so that runs perform both lookups and additions.
+        already_backed_up = rng.sample(destination_tracks, min(source_size // 2, destination_size))
+        discover_weekly = already_backed_up + [make_track_id(rng) for _ in range(source_size - len(already_backed_up))]
+        release_radar = [make_track_id(rng) for _ in range(source_size)]
+
+        if destination_size > 0:
+            self.add_playlist(destination_name, destination_tracks)
+
+        self.add_playlist('Discover Weekly', discover_weekly)
+        self.add_playlist('Release Radar', release_radar)
+
+    def add_playlist(self, name, track_ids):
+        """
+        Creates a playlist named `name` containing `track_ids` and returns it.
+
+        :param name:
+        :param track_ids:
+        :return:
+        """
+        self._playlist_counter += 1
+        playlist_id = f'playlist{self._playlist_counter:014d}'
+        playlist = {
+            'id': playlist_id,
+            'name': name,
+            'uri': f'spotify:playlist:{playlist_id}',
+            'snapshot_id': f'{playlist_id}-0',
+            'track_ids': list(track_ids),
+            'version': 0
+        }
+        self.playlists[playlist_id] = playlist
+
+        return playlist
+
+    def next_token(self):
+        """
+        Issues a new access token.
+
+        :return:
+        """
+        with self.lock:
+            self._token_counter += 1
+            return f'access-token-{self._token_counter}'
+
+    def record(self, endpoint, bytes_sent, bytes_received):
+        """
+        Records a served request against `endpoint`.
+
+        :param endpoint:
+        :param bytes_sent:
+        :param bytes_received:
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_sent'] += bytes_sent
+            self.stats['bytes_received'] += bytes_received
+            self.stats['endpoints'][endpoint] = self.stats['endpoints'].get(endpoint, 0) + 1
+
+    def inject_failure(self):
+        """
+        Determines whether the current API request should be rejected with an injected rate limit or expired token
+        response. Returns the status code to respond with or `None`.
+
+        :return:
+        """
+        with self.lock:
+            self._api_requests += 1
+
+            if self.rate_limit_every and self._api_requests % self.rate_limit_every == 0:
+                self.stats['rate_limited'] += 1
+                return 429
+
+            if self.expire_token_every and self._api_requests % self.expire_token_every == 0:
+                self.stats['tokens_expired'] += 1
+                return 401
+
+        return None
+
+    def reset_stats(self):
+        """
+        Clears the recorded request statistics.
+        """
+        with self.lock:
+            self.stats.update(requests=0, bytes_sent=0, bytes_received=0, rate_limited=0, tokens_expired=0,
+                              endpoints={})
+
+
+class MockSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        """
+        Overrides the parent to prevent request logs being printed.
+
+        :param args:
+        :param kwargs:
+        """
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length > 0 else b''
+
+    def _respond(self, endpoint, status, payload, body_length, headers=None):
+        body = json.dumps(payload).encode()
+        headers = dict(headers or {})
+
+        if self.command == 'GET' and status == 200:
+            headers['ETag'] = f'"{hashlib.md5(body).hexdigest()}"'
+
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                status = 304
+                body = b''
+
+        # The request is recorded before it is answered, so that once a client has received the response the request is
+        # always in the statistics.
+        self.state.record(endpoint, len(body), body_length)
+        self.send_response(status)
+
+        if status != 304:
+            self.send_header('Content-Type', 'application/json')
+
+        self.send_header('Content-Length', str(len(body)))
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        body = self._read_body()
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = url.path.rstrip('/').split('/')[1:]
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        if path == ['api', 'token'] and method == 'POST':
+            if self.state.refresh_token_revoked and parse_qs(body.decode()).get('grant_type') == ['refresh_token']:
+                payload = {'error': 'invalid_grant', 'error_description': 'Refresh token revoked'}
+                return self._respond('api/token', 400, payload, len(body))
+
+            payload = {
+                'access_token': self.state.next_token(),
+                'token_type': 'Bearer',
+                'expires_in': 3600
+            }
+            return self._respond('api/token', 200, payload, len(body))
+
+        if len(path) == 0 or path[0] != 'v1':
+            return self._respond('unknown', 404, {'error': {'status': 404, 'message': 'Not found'}}, len(body))
+
+        path = path[1:]
+        endpoint = '/'.join('{id}' if index == 1 and path[0] in ('playlists', 'users') else part
+                            for index, part in enumerate(path))
+        failure = self.state.inject_failure()
+
+        if failure == 429:
+            payload = {'error': {'status': 429, 'message': 'API rate limit exceeded'}}
+            return self._respond(endpoint, 429, payload, len(body), {'Retry-After': '1'})
+        elif failure == 401:
+            payload = {'error': {'status': 401, 'message': 'The access token expired'}}
+            return self._respond(endpoint, 401, payload, len(body))
+
+        route = getattr(self, f'_{method.lower()}_{endpoint.replace("/", "_").replace("{id}", "id")}', None)
+
+        if route is None:
+            return self._respond(endpoint, 404, {'error': {'status': 404, 'message': 'Not found'}}, len(body))
+
+        status, payload = route(path, query, json.loads(body) if body else None)
+        self._respond(endpoint, status, payload, len(body))
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _page(self, url, items, query, default_limit):
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', default_limit))
+        total = len(items)
+        next_url = None
+
+        if offset + limit < total:
+            next_url = f'http://{self.headers["Host"]}{url}?offset={offset + limit}&limit={limit}'
+
+        return {
+            'items': items[offset:offset + limit],
+            'offset': offset,
+            'limit': limit,
+            'total': total,
+            'next': next_url
+        }
+
+    @staticmethod
+    def _simplified_playlist(playlist):
+        return {
+            'id': playlist['id'],
+            'name': playlist['name'],
+            'uri': playlist['uri'],
+            'snapshot_id': playlist['snapshot_id'],
+            'owner': {'id': USER_ID},
+            'tracks': {'total': len(playlist['track_ids'])}
+        }
+
+    def _get_me(self, path, query, data):
+        return 200, {'id': USER_ID, 'display_name': 'Benchmark User'}
+
+    def _get_me_playlists(self, path, query, data):
+        playlists = [self._simplified_playlist(playlist) for playlist in self.state.playlists.values()]
+        return 200, self._page('/v1/me/playlists', playlists, query, 20)
+
+    def _get_playlists_id(self, path, query, data):
+        if path[1] not in self.state.playlists:
+            return 404, {'error': {'status': 404, 'message': 'Not found'}}
+
+        return 200, self._simplified_playlist(self.state.playlists[path[1]])
+
+    def _get_playlists_id_tracks(self, path, query, data):
+        if path[1] not in self.state.playlists:
+            return 404, {'error': {'status': 404, 'message': 'Not found'}}
+
+        fields = query.get('fields')
+        page = self._page(f'/v1/playlists/{path[1]}/tracks', self.state.playlists[path[1]]['track_ids'], query, 100)
+        page['items'] = [{'added_at': '2020-01-01T00:00:00Z', 'track': make_track(track_id, fields)}
+                         for track_id in page['items']]
+
+        return 200, page
+
+    def _post_playlists_id_tracks(self, path, query, data):
+        if path[1] not in self.state.playlists:
+            return 404, {'error': {'status': 404, 'message': 'Not found'}}
+
+        with self.state.lock:
+            playlist = self.state.playlists[path[1]]
+            playlist['track_ids'].extend(uri.split(':')[-1] for uri in data['uris'])
+            playlist['version'] += 1
+            playlist['snapshot_id'] = f'{playlist["id"]}-{playlist["version"]}'
+
+        return 201, {'snapshot_id': playlist['snapshot_id']}
+
+    def _post_users_id_playlists(self, path, query, data):
+        with self.state.lock:
+            playlist = self.state.add_playlist(data['name'], [])
+
+        return 201, self._simplified_playlist(playlist)
+
+
+class MockSpotifyServer:
+    def __init__(self, state, host='127.0.0.1', port=0):
+        self.state = state
+        self._server = ThreadingHTTPServer((host, port), MockSpotifyHandler)
+        self._server.daemon_threads = True
+        self._server.state = state
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """
+        Starts serving the mock API in a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the mock API server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
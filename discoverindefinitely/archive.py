@@ -0,0 +1,220 @@
+import heapq
+
+BASE62_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+BASE62_VALUES = {character: value for value, character in enumerate(BASE62_ALPHABET)}
+TRACK_ID_LENGTH = 22
+KEY_SIZE = 16
+
+
+def encode_track_id(track_id):
+    """
+    Decodes a base62 Spotify track ID to the 16 byte big-endian key stored in a `TrackArchive`. Big-endian keys sort in
+    the same order as the integers they represent, so the archive can be kept sorted by comparing bytes. A `ValueError`
+    is raised if `track_id` is not a 22 character base62 ID or does not fit in 128 bits.
+
+    :param track_id:
+    :return:
+    """
+    if not isinstance(track_id, str) or len(track_id) != TRACK_ID_LENGTH:
+        raise ValueError(f'Invalid track ID: {track_id!r}')
+
+    value = 0
+
+    for character in track_id:
+        if character not in BASE62_VALUES:
+            raise ValueError(f'Invalid track ID: {track_id!r}')
+
+        value = value * 62 + BASE62_VALUES[character]
+
+    if value >= 1 << (KEY_SIZE * 8):
+        raise ValueError(f'Track ID does not fit in 128 bits: {track_id!r}')
+
+    return value.to_bytes(KEY_SIZE, 'big')
+
+
+def is_track_id(track_id):
+    """
+    Determines whether `track_id` is a Spotify track ID that can be stored in a `TrackArchive`.
+
+    :param track_id:
+    :return:
+    """
+    try:
+        encode_track_id(track_id)
+    except ValueError:
+        return False
+
+    return True
+
+
+def decode_track_id(key):
+    """
+    Encodes a 16 byte key from a `TrackArchive` back to a 22 character base62 Spotify track ID.
+
+    :param key:
+    :return:
+    """
+    value = int.from_bytes(key, 'big')
+    characters = []
+
+    for _ in range(TRACK_ID_LENGTH):
+        value, remainder = divmod(value, 62)
+        characters.append(BASE62_ALPHABET[remainder])
+
+    return ''.join(reversed(characters))
+
+
+class TrackArchive:
+    def __init__(self, data=b''):
+        if len(data) % KEY_SIZE != 0:
+            raise ValueError('Archive data is not a whole number of keys')
+
+        self._data = bytearray(data)
+
+    def __len__(self):
+        return len(self._data) // KEY_SIZE
+
+    def __iter__(self):
+        return (decode_track_id(key) for key in self._keys())
+
+    def __contains__(self, track_id):
+        """
+        Checks whether `track_id` is in the archive with a binary search over its sorted keys. IDs that cannot be
+        encoded are never present.
+
+        :param track_id:
+        :return:
+        """
+        try:
+            key = encode_track_id(track_id)
+        except ValueError:
+            return False
+
+        index = self._bisect(key)
+        return index < len(self) and self._key(index) == key
+
+    def _key(self, index):
+        return self._data[index * KEY_SIZE:(index + 1) * KEY_SIZE]
+
+    def _keys(self):
+        data = self._data
+        return (data[offset:offset + KEY_SIZE] for offset in range(0, len(data), KEY_SIZE))
+
+    def _bisect(self, key, low=0):
+        """
+        Returns the index at which `key` would be inserted to keep the archive sorted, searching from `low` onwards.
+
+        :param key:
+        :param low:
+        :return:
+        """
+        high = len(self)
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def add(self, track_id):
+        """
+        Adds `track_id` to the archive if it is not already present. A `ValueError` is raised if `track_id` cannot be
+        encoded, so IDs from the API should be checked with `is_track_id` first.
+
+        :param track_id:
+        """
+        key = encode_track_id(track_id)
+        index = self._bisect(key)
+
+        if index == len(self) or self._key(index) != key:
+            self._data[index * KEY_SIZE:index * KEY_SIZE] = key
+
+    def update(self, track_ids):
+        """
+        Adds every one of `track_ids` to the archive. As with `add`, a `ValueError` is raised if any of them cannot be
+        encoded and the archive is left unchanged.
+
+        :param track_ids:
+        """
+        self._merge_keys(sorted({encode_track_id(track_id) for track_id in track_ids}))
+
+    def merge(self, archive):
+        """
+        Adds every track in another `TrackArchive` to this archive without decoding its keys.
+
+        :param archive:
+        """
+        self._data = TrackArchive.union([self, archive])._data
+
+    @staticmethod
+    def union(archives):
+        """
+        Returns a new archive containing every track in `archives`. As each archive is already sorted their keys are
+        combined with a k-way merge, streaming them into the new archive one at a time so that only the new archive is
+        held in memory alongside the existing ones.
+
+        :param archives:
+        :return:
+        """
+        archives = list(archives)
+
+        if len(archives) == 1:
+            return archives[0].copy()
+
+        data = bytearray()
+        previous_key = None
+
+        for key in heapq.merge(*(archive._keys() for archive in archives)):
+            if key != previous_key:
+                data += key
+                previous_key = key
+
+        union = TrackArchive()
+        union._data = data
+
+        return union
+
+    def _merge_keys(self, keys):
+        """
+        Merges the sorted, unique `keys` into the archive. The insertion point of each new key is found by a binary
+        search starting from the previous insertion point and the archive is rebuilt once from slices of the existing
+        data, so a bulk merge costs a single copy of the archive rather than one per key.
+
+        :param keys:
+        """
+        parts = []
+        previous_index = 0
+
+        for key in keys:
+            index = self._bisect(key, previous_index)
+
+            if index < len(self) and self._key(index) == key:
+                continue
+
+            parts.append(self._data[previous_index * KEY_SIZE:index * KEY_SIZE])
+            parts.append(key)
+            previous_index = index
+
+        if len(parts) > 0:
+            parts.append(self._data[previous_index * KEY_SIZE:])
+            self._data = bytearray(b''.join(parts))
+
+    def copy(self):
+        """
+        Returns a copy of the archive.
+
+        :return:
+        """
+        return TrackArchive(self._data)
+
+    def to_bytes(self):
+        """
+        Serialises the archive's keys for storage.
+
+        :return:
+        """
+        return bytes(self._data)
@@ -1,14 +1,9 @@
-import time
+import threading
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from multiprocessing import Process, Manager
-from urllib.parse import urlparse
+from urllib.parse import parse_qs, urlparse
 
 
 class RequestHandler(BaseHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        self._manager = None
-        super().__init__(*args, **kwargs)
-
     def log_request(self, *args, **kwargs):
         """
         Overrides the parent to prevent request logs being printed.
@@ -25,31 +20,28 @@ class RequestHandler(BaseHTTPRequestHandler):
         for the next stage of the authorisation flow.
 
         This server will only run when the callback is required. When hit, the server retrieves the access code from the
-        GET parameters and informs the user that they can close the window. The access code is stored by the process
-        manager so it can be retrieved by the `discoverindefinitely` process.
+        GET parameters and informs the user that they can close the window. The access code, or the error if the user
+        declined to authorise the application, is stored on the server and its `complete` event is set so that the
+        waiting `discoverindefinitely` thread can proceed.
         """
-        if self.path.startswith('/callback'):
-            query = urlparse(self.path).query
-
-            try:
-                parameters = dict(pair.split('=') for pair in query.split('&'))
-            except ValueError:
-                response_code = 400
-                message = 'Invalid query parameters'
+        url = urlparse(self.path)
+
+        if url.path == '/callback':
+            parameters = parse_qs(url.query)
+
+            if 'code' in parameters:
+                response_code = 200
+                message = 'Authorisation complete, you can now close this window.'
+                self.server.auth_code = parameters['code'][0]
+                self.server.complete.set()
+            elif 'error' in parameters:
+                response_code = 200
+                message = 'Authorisation failed please try again.'
+                self.server.error = parameters['error'][0]
+                self.server.complete.set()
             else:
-                if 'code' in parameters:
-                    response_code = 200
-                    message = 'Authorisation complete, you can now close this window.'
-                    self.server.complete.value = True
-                    self.server.success.value = True
-                    self.server.auth_code.value = parameters['code']
-                elif 'error' in parameters:
-                    response_code = 200
-                    message = 'Authorisation failed please try again.'
-                    self.server.success.value = False
-                else:
-                    response_code = 400
-                    message = '`error` and `code` missing from query parameters.'
+                response_code = 400
+                message = '`error` and `code` missing from query parameters.'
         else:
             response_code = 404
             message = 'Invalid endpoint'
@@ -61,57 +53,58 @@ class RequestHandler(BaseHTTPRequestHandler):
 
 class Server(HTTPServer):
     def __init__(self, *args, **kwargs):
-        self.complete = None
+        self.complete = threading.Event()
         self.auth_code = None
-        self.success = None
+        self.error = None
         super().__init__(*args, **kwargs)
 
-    def serve_forever(self, *args, **kwargs):
-        """
-        Overrides the parent `serve_forever` in order to feed in variables from the server's process manger. These
-        variables are used to track the authorisation progress and return the access code once complete.
-
-        :param args:
-        :param kwargs:
-        """
-        self.complete = kwargs['complete']
-        self.auth_code = kwargs['auth_code']
-        self.success = kwargs['success']
-        kwargs = {}
-        super().serve_forever(*args, **kwargs)
-
 
 class AuthorisationServer:
-    @staticmethod
-    def _serve(complete, auth_code, success):
+    def __init__(self, host='localhost', port=8080, timeout=None):
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._server = None
+        self._thread = None
+
+    @property
+    def redirect_uri(self):
         """
-        Runs `Server` on port 8080 to serve the API callback endpoint.
+        The callback URL that the API should redirect the user to. If the server was created with port 0 an ephemeral
+        port is used, which is only known once the server has been started.
 
-        :param complete:
-        :param auth_code:
-        :param success:
+        :return:
         """
-        server = Server(('0.0.0.0', 8080), RequestHandler)
-        server.serve_forever(complete=complete, auth_code=auth_code, success=success)
+        port = self._server.server_address[1] if self._server is not None else self._port
+        return f'http://{self._host}:{port}/callback'
 
     def start(self):
         """
-        When the API authorisation flow requires the callback URL a basic HTTP server is started on port 8080. The
-        server is run as a separate process to allow it to be easily terminated once the authorisation flow is ready to
-        proceed to the next step. A process manager is used to track the authorisation process state. When the API
-        callback is received and the access code is stored by the manager and the server process is terminated.
+        When the API authorisation flow requires the callback URL a basic HTTP server is started, on port 8080 unless
+        another port was given. The server is run in a background thread of the current process so that the calling
+        thread can wait for the callback and then shut the server down.
+        """
+        self._server = Server((self._host, self._port), RequestHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        """
+        Waits for the API callback to be received, or for the timeout given when the server was created to expire, and
+        then shuts the server down. The access code is returned if the user authorised the application, otherwise
+        `None` is returned.
 
         :return:
         """
-        manager = Manager()
-        complete = manager.Value('b', False)
-        success = manager.Value('b', False)
-        auth_code = manager.Value('s', '')
-        process = Process(target=self._serve, args=(complete, auth_code, success))
-        process.start()
-
-        while not complete.value:
-            time.sleep(0.5)
-
-        process.terminate()
-        return auth_code.value
+        try:
+            self._server.complete.wait(self._timeout)
+        finally:
+            self._server.shutdown()
+            self._server.server_close()
+
+        if self._server.error is not None:
+            print(f'Authorisation failed: {self._server.error}')
+        elif self._server.auth_code is None:
+            print('Timed out waiting for authorisation')
+
+        return self._server.auth_code
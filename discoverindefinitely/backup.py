@@ -1,102 +1,750 @@
 import argparse
+import gc
 import json
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
 
-from discoverindefinitely.spotify import SpotifyClient
+from discoverindefinitely.archive import is_track_id
+from discoverindefinitely.metrics import RequestMetrics
+from discoverindefinitely.spotify import RequestScheduler, SpotifyClient, SpotifyError
+from discoverindefinitely.tracing import Tracer, profile
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+DEFAULT_SCHEDULE = {
+    'days': ['monday'],
+    'time': '06:00'
+}
+DEFAULT_MAX_PLAYLIST_SIZE = 10000
+DEFAULT_SOURCE_PLAYLISTS = ['Discover Weekly', 'Release Radar']
+MAX_SOURCE_WORKERS = 8
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+MAX_TRACKS_PER_REQUEST = 100
+
+
+class ConfigurationError(Exception):
+    pass
 
 
 def get_playlist(target_playlist, playlists):
     """
-    Searches for a playlist named `target_playlist` in the list `playlists`.
+    Looks up the playlist named `target_playlist` in `playlists`, a dictionary of playlists indexed by name.
 
     :param target_playlist:
     :param playlists:
     :return:
     """
-    for playlist in playlists:
-        if playlist['name'] == target_playlist:
-            return playlist
+    return playlists.get(target_playlist)
 
 
-def identify_tracks_to_add(client, source_playlist, destination_playlist):
+def get_source_tracks(client, source_playlist):
     """
-    Examines the track list of `destination_playlist` to determine if tracks in `source_playlist` are present. Tracks
-    from `source_playlist` that are not present in `destination_playlist` are added to a list of tracks to be later
-    added to `destination_playlist`.
+    Retrieves the ID and URI of every track in `source_playlist`, in playlist order. Local files and tracks that are no
+    longer available have no ID and are skipped, as are any items whose ID is not a Spotify track ID, which could not
+    be checked against the destination's index.
 
     :param client:
     :param source_playlist:
-    :param destination_playlist:
     :return:
     """
-    identified_tracks = []
+    with client.tracer.span('fetch_source', playlist=source_playlist['name']):
+        return [
+            track['track'] for track in client.iter_playlist_tracks(source_playlist, fields='uri_id')
+            if track['track'] is not None and is_track_id(track['track']['id'])
+        ]
 
-    if source_playlist is not None:
-        source_playlist_tracks = client.get_playlist_tracks(source_playlist)
 
-        for track in source_playlist_tracks:
-            track_in_destination_playlist = client.search_playlist(track['track']['id'], destination_playlist)
+def identify_tracks_to_add(source_tracks, destination_index):
+    """
+    Examines `destination_index`, the archive of track IDs already present in the destination playlist, to determine if
+    each of `source_tracks` is present. The URIs of tracks that are not present are returned so they can be added to
+    the destination playlist and their IDs are added to `destination_index` so the same track is never identified twice
+    in a single run, even if it appears in more than one source playlist.
 
-            if not track_in_destination_playlist:
-                identified_tracks.append(track['track']['uri'])
+    :param source_tracks:
+    :param destination_index:
+    :return:
+    """
+    identified_tracks = []
+
+    for track in source_tracks:
+        if track['id'] not in destination_index:
+            identified_tracks.append(track['uri'])
+            destination_index.add(track['id'])
 
     return identified_tracks
 
 
-def main(application_config):
+def get_shard_name(destination_playlist, shard_number):
+    """
+    Returns the name of the destination playlist's `shard_number`th shard. The first shard is the destination playlist
+    itself and later shards are numbered from 2, e.g. "Backups 2".
+
+    :param destination_playlist:
+    :param shard_number:
+    :return:
+    """
+    if shard_number == 1:
+        return destination_playlist
+
+    return f'{destination_playlist} {shard_number}'
+
+
+def get_shard_names(client, destination_playlist):
+    """
+    Returns the names of the destination playlist's shards that the client has seen before, in order. The first shard is
+    always included so that it is created if it does not exist yet.
+
+    :param client:
+    :param destination_playlist:
+    :return:
+    """
+    shard_names = [destination_playlist]
+
+    while True:
+        shard_name = get_shard_name(destination_playlist, len(shard_names) + 1)
+
+        if shard_name not in client.get_known_playlist_ids([shard_name]):
+            return shard_names
+
+        shard_names.append(shard_name)
+
+
+def get_track_count(playlist):
+    """
+    Returns the track total included with `playlist` by the API, or `None` if it was not included.
+
+    :param playlist:
+    :return:
+    """
+    return playlist.get('tracks', {}).get('total')
+
+
+def find_shards(client, destination_playlist, source_names, max_playlist_size):
+    """
+    Finds the destination playlist's shards along with the playlists named by `source_names`. A list of the shards and
+    a dictionary of the source playlists found, indexed by name, are returned.
+
+    Only the last shard can still grow, so it is the only shard retrieved from the API. Earlier shards are full and are
+    identified by their cached IDs alone. If the last shard known to the client is full, for example because the local
+    database is new, later shards are looked for until one with space is found so that every existing shard is part of
+    the run's index. If the destination playlist does not exist yet it is created.
+
+    :param client:
+    :param destination_playlist:
+    :param source_names:
+    :param max_playlist_size:
+    :return:
+    """
+    while True:
+        shard_names = get_shard_names(client, destination_playlist)
+        playlists = client.find_playlists([shard_names[-1]] + source_names)
+
+        # Paging through the listing may reveal shards that were not known, and a deleted shard is dropped from the
+        # cache, either of which changes which shard is the last.
+        if get_shard_names(client, destination_playlist) == shard_names:
+            break
+
+    shard_ids = client.get_known_playlist_ids(shard_names[:-1])
+    shards = [{'id': shard_ids[shard_name], 'name': shard_name} for shard_name in shard_names[:-1]]
+    last_shard = get_playlist(shard_names[-1], playlists)
+
+    if last_shard is None:
+        last_shard = client.make_playlist(shard_names[-1])
+
+    while get_track_count(last_shard) is not None and get_track_count(last_shard) >= max_playlist_size:
+        shard_name = get_shard_name(destination_playlist, len(shards) + 2)
+        next_shard = get_playlist(shard_name, client.find_playlists([shard_name]))
+
+        if next_shard is None:
+            break
+
+        shards.append(last_shard)
+        last_shard = next_shard
+
+    shards.append(last_shard)
+    source_playlists = {name: playlists[name] for name in source_names if name in playlists}
+
+    return shards, source_playlists
+
+
+def add_tracks_to_shards(client, tracks, shards, destination_playlist, max_playlist_size, destination_index):
+    """
+    Adds `tracks` to the last of the destination playlist's `shards`. When that shard reaches `max_playlist_size` the
+    remaining tracks roll over to the next shard, which is created if it does not already exist and appended to
+    `shards`. If the next shard already exists but was not known to the client, tracks already present in it are
+    skipped and its tracks are merged into `destination_index`, the archive of every shard's tracks, so that the index
+    stored at the end of the run covers the shard. The tracks that were added are returned.
+
+    :param client:
+    :param tracks:
+    :param shards:
+    :param destination_playlist:
+    :param max_playlist_size:
+    :param destination_index:
+    :return:
+    """
+    added_tracks = []
+
+    while len(tracks) > 0:
+        shard = shards[-1]
+        space = max_playlist_size - client.get_playlist_track_count(shard)
+
+        if space <= 0:
+            shard_name = get_shard_name(destination_playlist, len(shards) + 1)
+            shard = get_playlist(shard_name, client.find_playlists([shard_name]))
+
+            if shard is None:
+                shard = client.make_playlist(shard_name)
+            else:
+                shard_index = client.get_playlist_index(shard)
+                tracks = [track for track in tracks if track.split(':')[-1] not in shard_index]
+                destination_index.merge(shard_index)
+
+            shards.append(shard)
+            continue
+
+        client.add_tracks_to_playlist(tracks[:space], shard)
+        added_tracks.extend(tracks[:space])
+        tracks = tracks[space:]
+
+    return added_tracks
+
+
+def get_flushable_track_count(client, shards, track_count, max_playlist_size):
+    """
+    Returns how many of `track_count` tracks waiting to be added to the destination's `shards` can be added now without
+    sending a request that tracks identified later could have been part of. These are the tracks that fill whole
+    requests, along with any that fill the last shard, as the requests for a shard are complete once it is full.
+
+    :param client:
+    :param shards:
+    :param track_count:
+    :param max_playlist_size:
+    :return:
+    """
+    space = max_playlist_size - client.get_playlist_track_count(shards[-1])
+
+    if space <= 0:
+        space = max_playlist_size
+
+    flushable_count = 0
+
+    while track_count >= space:
+        flushable_count += space
+        track_count -= space
+        space = max_playlist_size
+
+    return flushable_count + track_count - track_count % MAX_TRACKS_PER_REQUEST
+
+
+def create_scheduler(application_config):
+    """
+    Creates a `RequestScheduler` using the configuration's `requests_per_second` if it is set. Bursts of up to twice
+    that many requests are allowed, and always at least one, so that a budget below one request per second still grants
+    requests.
+
+    :param application_config:
+    :return:
+    """
+    if 'requests_per_second' in application_config:
+        requests_per_second = application_config['requests_per_second']
+        return RequestScheduler(requests_per_second, burst=max(1, 2 * requests_per_second))
+
+    return RequestScheduler()
+
+
+def create_client(application_config, scheduler=None, tracer=None, log=None):
+    """
+    Creates a `SpotifyClient` from `application_config`. Besides the client credentials the configuration may optionally
+    set `api_url` and `accounts_url` to point the client at a different API host, `database_path` to use a database
+    other than the default, `requests_per_second` to change the client's request budget, `connect_timeout` and
+    `read_timeout` to change how many seconds a request may take to connect and to respond and `auth_port` or
+    `auth_timeout` to change the port and timeout of the authorisation callback server. If `scheduler` is set the
+    client uses it instead of creating its own request budget, if `tracer` is set the client records timing spans
+    with it and if `log` is set the client's messages are passed to it rather than printed.
+
+    :param application_config:
+    :param scheduler:
+    :param tracer:
+    :param log:
+    :return:
+    """
+    client_options = {
+        option: application_config[option]
+        for option in ['api_url', 'accounts_url', 'database_path', 'auth_port', 'auth_timeout']
+        if option in application_config
+    }
+
+    if scheduler is not None:
+        client_options['scheduler'] = scheduler
+    elif 'requests_per_second' in application_config:
+        client_options['scheduler'] = create_scheduler(application_config)
+
+    if tracer is not None:
+        client_options['tracer'] = tracer
+
+    if log is not None:
+        client_options['log'] = log
+
+    if 'connect_timeout' in application_config or 'read_timeout' in application_config:
+        client_options['timeout'] = (application_config.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+                                     application_config.get('read_timeout', DEFAULT_READ_TIMEOUT))
+
+    return SpotifyClient(application_config['client_id'], application_config['client_secret'], **client_options)
+
+
+def run_backup(client, application_config, metrics_json=None, metrics_prometheus=None, trace_path=None):
+    """
+    Performs the playlist backup process using an existing `client`.
+
+    The source playlists named by the configuration's `source_playlists`, Discover Weekly and Release Radar by default,
+    are retrieved concurrently. As each source arrives its tracks are checked against the destination's index, which
+    also holds the tracks identified from sources that arrived before it. New tracks are collected in the order they
+    are identified and every full request's worth, or enough to fill a shard, is added to the destination straight
+    away while the remaining sources are still being retrieved. Whatever is left is added once every source has been
+    checked, so the tracks are added in as few requests as possible.
+
+    If `metrics_json` or `metrics_prometheus` are set the client's request metrics are written to them at the end of the
+    run, as JSON and as a Prometheus textfile collector file respectively. If `trace_path` is set the timing spans
+    recorded by the client's tracer during the run are written to it as Chrome trace event JSON.
+
+    :param client:
+    :param application_config:
+    :param metrics_json:
+    :param metrics_prometheus:
+    :param trace_path:
+    :return:
+    """
+    destination_playlist = application_config['destination_playlist']
+    max_playlist_size = application_config.get('max_playlist_size', DEFAULT_MAX_PLAYLIST_SIZE)
+    source_names = application_config.get('source_playlists', DEFAULT_SOURCE_PLAYLISTS)
+    client.tracer.reset()
+
+    with client.tracer.span('find_playlists'):
+        shards, playlists = find_shards(client, destination_playlist, source_names, max_playlist_size)
+
+    resumed_tracks = sum(client.resume_pending_writes(shard) for shard in shards)
+
+    if resumed_tracks > 0:
+        client.log(f'Resumed {resumed_tracks} tracks from an interrupted run')
+
+    # Only the last shard can have changed, and unless tracks were just resumed the snapshot returned when it was looked
+    # up is still current. The merged index of every shard then only has to be rebuilt if the last shard has changed.
+    last_shard = shards[-1]
+    snapshot = None
+
+    if resumed_tracks == 0 and 'snapshot_id' in last_shard and get_track_count(last_shard) is not None:
+        snapshot = (last_shard['snapshot_id'], get_track_count(last_shard))
+
+    with client.tracer.span('build_index', shards=len(shards)):
+        client.get_playlist_index(last_shard, snapshot)
+        target_index = client.get_merged_index(destination_playlist, shards)
+
+    source_playlists = []
+
+    for source_name in dict.fromkeys(source_names):
+        source_playlist = get_playlist(source_name, playlists)
+
+        if source_playlist is None:
+            client.log(f'Source playlist {source_name} not found')
+        else:
+            source_playlists.append(source_playlist)
+
+    tracks_to_add = []
+    pending_tracks = []
+
+    if len(source_playlists) > 0:
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        with ThreadPoolExecutor(max_workers=min(len(source_playlists), MAX_SOURCE_WORKERS)) as executor:
+            futures = [executor.submit(get_source_tracks, client, playlist) for playlist in source_playlists]
+
+            for future in as_completed(futures):
+                source_tracks = future.result()
+
+                with client.tracer.span('dedup', tracks=len(source_tracks)):
+                    identified_tracks = identify_tracks_to_add(source_tracks, target_index)
+
+                pending_tracks.extend(identified_tracks)
+                flushable_count = get_flushable_track_count(client, shards, len(pending_tracks), max_playlist_size)
+
+                if flushable_count > 0:
+                    with client.tracer.span('add_tracks', tracks=flushable_count):
+                        tracks_to_add.extend(add_tracks_to_shards(client, pending_tracks[:flushable_count], shards,
+                                                                  destination_playlist, max_playlist_size,
+                                                                  target_index))
+
+                    pending_tracks = pending_tracks[flushable_count:]
+
+    if len(pending_tracks) > 0:
+        with client.tracer.span('add_tracks', tracks=len(pending_tracks)):
+            tracks_to_add.extend(add_tracks_to_shards(client, pending_tracks, shards, destination_playlist,
+                                                      max_playlist_size, target_index))
+
+    if len(tracks_to_add) > 0:
+        client.store_merged_index(destination_playlist, shards, target_index)
+
+    client.metrics.set_run_info(tracks_added=len(tracks_to_add))
+
+    if metrics_json is not None:
+        client.metrics.write_json(metrics_json)
+
+    if metrics_prometheus is not None:
+        client.metrics.write_prometheus(metrics_prometheus)
+
+    if trace_path is not None:
+        client.tracer.write_json(trace_path)
+
+    return tracks_to_add
+
+
+def main(application_config, metrics_json=None, metrics_prometheus=None, trace_path=None):
     """
     Uses the `application_config` to setup the Spotify client establishing an API connection then simply calls functions
     and API handlers to perform the playlist backup process.
 
     :param application_config:
+    :param metrics_json:
+    :param metrics_prometheus:
+    :param trace_path:
     """
-    client = SpotifyClient(application_config['client_id'], application_config['client_secret'])
-    playlists = client.get_user_playlists()
-    target_playlist = get_playlist(application_config['destination_playlist'], playlists)
-    discover_weekly_playlist = get_playlist('Discover Weekly', playlists)
-    release_radar_playlist = get_playlist('Release Radar', playlists)
+    tracer = Tracer() if trace_path is not None else None
 
-    if target_playlist is None:
-        target_playlist = client.make_playlist(application_config['destination_playlist'])
+    with create_client(application_config, tracer=tracer) as client:
+        run_backup(client, application_config, metrics_json, metrics_prometheus, trace_path)
 
-    tracks_to_add = []
-    tracks_to_add.extend(identify_tracks_to_add(client, discover_weekly_playlist, target_playlist))
-    tracks_to_add.extend(identify_tracks_to_add(client, release_radar_playlist, target_playlist))
-    client.add_tracks_to_playlist(tracks_to_add, target_playlist)
+
+def get_next_run(schedule, now):
+    """
+    Returns the first time after `now` that matches `schedule`, a dictionary containing a list of weekday names under
+    `days` and a local time in 24-hour `HH:MM` format under `time`.
+
+    :param schedule:
+    :param now:
+    :return:
+    """
+    hour, minute = (int(value) for value in schedule['time'].split(':'))
+    days = {WEEKDAYS.index(day.lower()) for day in schedule['days']}
+
+    for day_offset in range(8):
+        candidate = (now + timedelta(days=day_offset)).replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+        if candidate.weekday() in days and candidate > now:
+            return candidate
+
+
+def run_daemon(application_config, metrics_json=None, metrics_prometheus=None, trace_path=None):
+    """
+    Keeps a single Spotify client alive and performs a backup each time the configuration's `schedule` is due, or on
+    Monday mornings shortly after Discover Weekly is refreshed if no schedule is configured. As the client persists
+    between runs its connection pool, access token and destination playlist index stay warm. Request metrics and timing
+    spans are reset before each run so the daemon's memory use does not grow over time.
+
+    A failed run is reported and the daemon waits for the next scheduled run rather than exiting.
+
+    :param application_config:
+    :param metrics_json:
+    :param metrics_prometheus:
+    :param trace_path:
+    """
+    schedule = application_config.get('schedule', DEFAULT_SCHEDULE)
+    tracer = Tracer() if trace_path is not None else None
+
+    with create_client(application_config, tracer=tracer) as client:
+        while True:
+            next_run = get_next_run(schedule, datetime.now())
+            print(f'Next backup scheduled for {next_run:%Y-%m-%d %H:%M}')
+            time.sleep(max(0, (next_run - datetime.now()).total_seconds()))
+            client.metrics = RequestMetrics()
+
+            try:
+                tracks_added = run_backup(client, application_config, metrics_json, metrics_prometheus, trace_path)
+            except Exception as error:
+                print(f'Backup failed: {describe_error(error)}')
+            else:
+                print(f'Backup complete, {len(tracks_added)} tracks added')
+
+            gc.collect()
+
+
+def load_configuration(config_file):
+    """
+    Loads and validates the JSON configuration file at `config_file`. A `ConfigurationError` is raised if the file is
+    missing or invalid.
+
+    :param config_file:
+    :return:
+    """
+    if not config_file.is_file():
+        raise ConfigurationError(f'Configuration file does not exist at {config_file.resolve()}')
+
+    try:
+        with config_file.open('r') as config:
+            configuration = json.load(config)
+    except ValueError as error:
+        raise ConfigurationError(f'Configuration file is not valid JSON: {error}')
+
+    validate_configuration(configuration)
+    return configuration
+
+
+def find_batch_configurations(paths):
+    """
+    Expands `paths`, a list of configuration files and directories, into a sorted list of configuration files. Every
+    `.json` file directly inside a directory is treated as a configuration file.
+
+    :param paths:
+    :return:
+    """
+    config_files = set()
+
+    for path in map(Path, paths):
+        if path.is_dir():
+            config_files.update(path.glob('*.json'))
+        else:
+            config_files.add(path)
+
+    return sorted(config_files)
+
+
+def run_account(config_file, schedulers):
+    """
+    Performs the backup process for the account configured by `config_file` as part of a batch and returns a summary of
+    the run. Accounts that share a client ID share the matching request scheduler in `schedulers`, as the API applies
+    its rate limit per application.
+
+    Accounts must have been authorised beforehand as the interactive authorisation flow cannot run in a batch. The
+    configuration must therefore set `database_path`, so that a single run of the same configuration stores its tokens
+    where the batch looks for them and accounts never share tokens or playlist indexes. Messages from the run, such as
+    a source playlist that could not be found, are recorded in the summary's `warnings` and if the run fails the reason
+    is recorded in the summary as well. Neither is printed, so that the output of concurrent runs is not interleaved
+    and can be traced back to its account.
+
+    :param config_file:
+    :param schedulers:
+    :return:
+    """
+    summary = {
+        'config': str(config_file),
+        'status': 'failed',
+        'tracks_added': 0,
+        'requests': 0,
+        'warnings': []
+    }
+    start = time.perf_counter()
+
+    try:
+        from discoverindefinitely.database import DatabaseClient
+
+        application_config = load_configuration(config_file)
+        authorised = False
+
+        if 'database_path' not in application_config:
+            raise ConfigurationError('database_path must be set to back up an account in a batch')
+
+        if Path(application_config['database_path']).is_file():
+            db_client = DatabaseClient(application_config['database_path'])
+            authorised = db_client.get_value('refresh_token') is not None
+            db_client.close()
+
+        if not authorised:
+            summary['status'] = 'unauthorised'
+        else:
+            with create_client(application_config, schedulers[application_config['client_id']],
+                               log=summary['warnings'].append) as client:
+                summary['tracks_added'] = len(run_backup(client, application_config))
+                summary['requests'] = sum(endpoint['requests'] for endpoint in client.metrics.to_dict()['endpoints'])
+                summary['status'] = 'ok'
+    except Exception as error:
+        summary['error'] = describe_error(error)
+
+    summary['duration_seconds'] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def run_batch(paths, workers=8, summary_path=None):
+    """
+    Performs the backup process for every account configured by `paths`, a list of configuration files and directories
+    of configuration files. Accounts are backed up concurrently by a pool of up to `workers` threads and a consolidated
+    summary of the runs is printed and, if `summary_path` is set, written to it as JSON.
+
+    :param paths:
+    :param workers:
+    :param summary_path:
+    :return:
+    """
+    config_files = find_batch_configurations(paths)
+    schedulers = {}
+
+    # Invalid configurations are skipped here and reported when their account is run, so that they cannot set the
+    # request budget of the valid accounts sharing their client ID.
+    for config_file in config_files:
+        try:
+            application_config = load_configuration(config_file)
+        except (OSError, ConfigurationError):
+            continue
+
+        if application_config['client_id'] not in schedulers:
+            schedulers[application_config['client_id']] = create_scheduler(application_config)
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        summaries = list(executor.map(lambda config_file: run_account(config_file, schedulers), config_files))
+
+    print(f'{"status":<13} {"tracks":>6} {"requests":>8} {"time":>9}  config')
+
+    for summary in summaries:
+        print(f'{summary["status"]:<13} {summary["tracks_added"]:>6} {summary["requests"]:>8} '
+              f'{summary["duration_seconds"]:>8.1f}s  {summary["config"]}')
+
+    for summary in summaries:
+        for warning in summary['warnings']:
+            print(f'{summary["config"]}: {warning}')
+
+        if 'error' in summary:
+            print(f'{summary["config"]}: {summary["error"]}')
+
+    succeeded = sum(summary['status'] == 'ok' for summary in summaries)
+    print(f'{succeeded} of {len(summaries)} accounts backed up, '
+          f'{sum(summary["tracks_added"] for summary in summaries)} tracks added')
+
+    if summary_path is not None:
+        with open(summary_path, 'w') as summary_file:
+            json.dump(summaries, summary_file, indent=4)
+
+    return summaries
+
+
+def describe_error(error):
+    """
+    Returns a message describing `error` for reports. Errors raised by the application already carry a message suitable
+    for the user, anything else is described by its type as well.
+
+    :param error:
+    :return:
+    """
+    if isinstance(error, (ConfigurationError, SpotifyError)):
+        return str(error)
+
+    return repr(error)
+
+
+def is_positive_number(value):
+    """
+    Determines whether `value` loaded from the configuration file is a number greater than zero.
+
+    :param value:
+    :return:
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
 
 
 def validate_configuration(application_config):
     """
-    Parses the JSON loaded from the configuration file to ensure that the required keys any values are present.
+    Parses the JSON loaded from the configuration file to ensure that the required keys any values are present. A
+    `ConfigurationError` is raised describing the first problem found.
 
     :param application_config:
     """
+    if not isinstance(application_config, dict):
+        raise ConfigurationError('Configuration file must contain a JSON object')
+
     required_fields = ['client_id', 'client_secret', 'destination_playlist']
 
     for field in required_fields:
         if field not in application_config:
-            print(f'Configuration file must contain {field}')
-            exit(1)
+            raise ConfigurationError(f'Configuration file must contain {field}')
         elif not isinstance(application_config[field], str):
-            print(f'{field} must be a string')
-            exit(1)
+            raise ConfigurationError(f'{field} must be a string')
         elif len(application_config[field]) <= 0:
-            print(f'{field} must have a value')
-            exit(1)
+            raise ConfigurationError(f'{field} must have a value')
+
+    if 'source_playlists' in application_config:
+        source_playlists = application_config['source_playlists']
+
+        if not isinstance(source_playlists, list) or len(source_playlists) <= 0 or \
+                any(not isinstance(name, str) or len(name) <= 0 for name in source_playlists):
+            raise ConfigurationError('source_playlists must be a list of one or more playlist names')
+
+    if 'max_playlist_size' in application_config:
+        max_playlist_size = application_config['max_playlist_size']
+
+        if not isinstance(max_playlist_size, int) or isinstance(max_playlist_size, bool) or max_playlist_size <= 0:
+            raise ConfigurationError('max_playlist_size must be a positive integer')
+
+    if 'requests_per_second' in application_config and \
+            not is_positive_number(application_config['requests_per_second']):
+        raise ConfigurationError('requests_per_second must be a positive number')
+
+    for field in ['connect_timeout', 'read_timeout', 'auth_timeout']:
+        if field in application_config and not is_positive_number(application_config[field]):
+            raise ConfigurationError(f'{field} must be a positive number of seconds')
+
+    if 'auth_port' in application_config:
+        auth_port = application_config['auth_port']
+
+        if not isinstance(auth_port, int) or isinstance(auth_port, bool) or not 0 <= auth_port <= 65535:
+            raise ConfigurationError('auth_port must be a port number between 0 and 65535')
+
+    if 'database_path' in application_config:
+        database_path = application_config['database_path']
+
+        if not isinstance(database_path, str) or len(database_path) <= 0:
+            raise ConfigurationError('database_path must be a path to a file')
+
+    if 'schedule' in application_config:
+        schedule = application_config['schedule']
+
+        if not isinstance(schedule, dict) or not isinstance(schedule.get('days'), list) or \
+                not isinstance(schedule.get('time'), str):
+            raise ConfigurationError('schedule must contain a list of days and a time')
+        elif len(schedule['days']) <= 0 or \
+                any(not isinstance(day, str) or day.lower() not in WEEKDAYS for day in schedule['days']):
+            raise ConfigurationError(f'schedule days must be one or more of {", ".join(WEEKDAYS)}')
+
+        try:
+            datetime.strptime(schedule['time'], '%H:%M')
+        except ValueError:
+            raise ConfigurationError('schedule time must be in HH:MM format')
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Backup your Spotify Discover Weekly and Release Radar playlists')
     parser.add_argument('-c', '--config', help='Configuration file', default='config.json')
+    parser.add_argument('--metrics-json', help='Write request metrics for the run to this file as JSON')
+    parser.add_argument('--metrics-prometheus', help='Write request metrics for the run to this Prometheus textfile')
+    parser.add_argument('--daemon', help='Keep running and perform backups on a schedule', action='store_true')
+    parser.add_argument('--batch', help='Back up every account configured by these files or directories', nargs='+')
+    parser.add_argument('--workers', help='Number of accounts backed up concurrently in batch mode', type=int,
+                        default=8)
+    parser.add_argument('--summary', help='Write a summary of the batch run to this file as JSON')
+    parser.add_argument('--profile', help='Write a timeline of the run to this file as Chrome trace event JSON')
+    parser.add_argument('--cprofile', help='Profile the run with cProfile and print the slowest functions',
+                        action='store_true')
     args = parser.parse_args()
-    config_file = Path(args.config)
 
-    if not config_file.is_file():
-        print(f'Configuration file does not exist at {config_file.resolve()}')
-        exit(1)
+    if args.cprofile and (args.daemon or args.batch is not None):
+        parser.error('--cprofile can only be used with a single backup run, not with --daemon or --batch')
 
-    with config_file.open('r') as config:
-        configuration = json.load(config)
+    if args.profile is not None and args.batch is not None:
+        parser.error('--profile cannot be used with --batch')
 
-    validate_configuration(configuration)
-    main(configuration)
+    if args.batch is not None:
+        summaries = run_batch(args.batch, args.workers, args.summary)
+        exit(0 if all(summary['status'] == 'ok' for summary in summaries) else 1)
+
+    try:
+        configuration = load_configuration(Path(args.config))
+
+        if args.daemon:
+            run_daemon(configuration, args.metrics_json, args.metrics_prometheus, args.profile)
+        elif args.cprofile:
+            profile(main, configuration, args.metrics_json, args.metrics_prometheus, args.profile)
+        else:
+            main(configuration, args.metrics_json, args.metrics_prometheus, args.profile)
+    except (ConfigurationError, SpotifyError) as error:
+        print(error)
+        exit(1)
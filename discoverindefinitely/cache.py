@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+DECODED_CACHE_SIZE = 256
+
+
+class ResponseCache:
+    def __init__(self, get_db_client, max_size=50 * 1024 * 1024, decode=json.loads, decoded_size=DECODED_CACHE_SIZE):
+        self._get_db_client = get_db_client
+        self._max_size = max_size
+        self._decode = decode
+        self._decoded_size = decoded_size
+        self._decoded = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._max_size > 0
+
+    @staticmethod
+    def get_key(url, params=None):
+        """
+        Builds the cache key for a GET request to `url` with the query `params`. Parameters that are not set are
+        omitted, as they are not sent with the request.
+
+        :param url:
+        :param params:
+        :return:
+        """
+        if not params:
+            return url
+
+        query = urlencode(sorted((key, value) for key, value in params.items() if value is not None))
+        return f'{url}?{query}'
+
+    def get(self, key):
+        """
+        Retrieves the response cached under `key` as a tuple of its ETag, body and decoded body, or `None` if no
+        response is cached. The decoded bodies of the most recently used responses are kept in memory, in which case
+        the body is not read from the database and is `None`. Otherwise the decoded body is `None`.
+
+        :param key:
+        :return:
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            if key in self._decoded:
+                etag, decoded = self._decoded[key]
+                return etag, None, decoded
+
+        cached_response = self._get_db_client().get_cached_response(key)
+
+        return (*cached_response, None) if cached_response is not None else None
+
+    def hit(self, key, cached_response):
+        """
+        Records that `cached_response`, as returned by `get` for `key`, was reused because the API reported it was
+        unchanged and returns its decoded body. The body is only decoded if it is not already held in memory.
+
+        Decoded bodies are shared between every request that reuses them and must not be modified.
+
+        :param key:
+        :param cached_response:
+        :return:
+        """
+        etag, body, decoded = cached_response
+        self._get_db_client().touch_cached_response(key, time.time())
+
+        if decoded is None:
+            decoded = self._decode(body)
+
+        self._remember(key, etag, decoded)
+
+        return decoded
+
+    def miss(self, key, etag, body):
+        """
+        Records that the response to the request cached under `key` had to be retrieved in full and returns its decoded
+        body. If the API sent an `etag` the response `body` is cached so that it can be revalidated by the next
+        identical request.
+
+        :param key:
+        :param etag:
+        :param body:
+        :return:
+        """
+        decoded = self._decode(body)
+
+        if self.enabled and etag is not None and len(body) <= self._max_size:
+            self._get_db_client().set_cached_response(key, etag, body, time.time(), self._max_size)
+            self._remember(key, etag, decoded)
+
+        return decoded
+
+    def _remember(self, key, etag, decoded):
+        """
+        Keeps the `decoded` body of the response cached under `key` in memory, evicting the least recently used body
+        once more than `decoded_size` are held.
+
+        :param key:
+        :param etag:
+        :param decoded:
+        """
+        with self._lock:
+            self._decoded[key] = (etag, decoded)
+            self._decoded.move_to_end(key)
+
+            while len(self._decoded) > self._decoded_size:
+                self._decoded.popitem(last=False)
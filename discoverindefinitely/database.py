@@ -1,24 +1,104 @@
+import json
 import sqlite3
+import threading
 from pathlib import Path
 
+from discoverindefinitely.archive import TrackArchive, is_track_id
+
 
 class DatabaseClient:
-    def __init__(self):
-        self._db_path = (Path(__file__).parent / 'db.sqlite').resolve()
-        connection = self._connect()
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = Path(__file__).parent / 'db.sqlite'
 
-        with connection:
-            connection.execute('CREATE TABLE IF NOT EXISTS configuration (key TEXT, value TEXT)')
+        self._db_path = Path(db_path).resolve()
+        self._lock = threading.Lock()
+        self._connection = self._connect()
 
-        connection.close()
+        with self._connection:
+            self._migrate_configuration()
+            self._connection.execute('CREATE TABLE IF NOT EXISTS configuration (key TEXT PRIMARY KEY, value TEXT)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS playlist_snapshots '
+                                     '(playlist_id TEXT PRIMARY KEY, snapshot_id TEXT, track_count INTEGER)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS playlist_archives '
+                                     '(playlist_id TEXT PRIMARY KEY, track_ids BLOB)')
+            self._migrate_playlist_tracks()
+            self._connection.execute('CREATE TABLE IF NOT EXISTS merged_indexes '
+                                     '(name TEXT PRIMARY KEY, signature TEXT, track_ids BLOB)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS playlist_names '
+                                     '(name TEXT PRIMARY KEY, playlist_id TEXT)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS response_cache '
+                                     '(key TEXT PRIMARY KEY, etag TEXT, body BLOB, size INTEGER, last_used REAL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS response_cache_last_used '
+                                     'ON response_cache (last_used)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS write_journal '
+                                     '(playlist_id TEXT, chunk_index INTEGER, track_uris TEXT, base_snapshot_id TEXT, '
+                                     'snapshot_id TEXT, PRIMARY KEY (playlist_id, chunk_index))')
 
     def _connect(self):
         """
-        Creates and returns a connection to the SQLite database.
+        Creates and returns a connection to the SQLite database. The connection is kept open for the lifetime of the
+        client and may be used from any thread, access to it is serialised by the client. The database is switched to
+        write-ahead logging so that reads are not blocked by writes and commits do not require a full sync.
 
         :return:
         """
-        return sqlite3.connect(self._db_path)
+        connection = sqlite3.connect(self._db_path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.execute('PRAGMA busy_timeout = 5000')
+        connection.execute('PRAGMA temp_store = MEMORY')
+
+        return connection
+
+    def _migrate_configuration(self):
+        """
+        Databases created by earlier versions have a `configuration` table without a key constraint. If one is found it
+        is rebuilt with `key` as the primary key, keeping the most recently written value of any duplicated keys.
+        """
+        columns = self._connection.execute('PRAGMA table_info(configuration)').fetchall()
+
+        if len(columns) == 0 or any(column[1] == 'key' and column[5] for column in columns):
+            return
+
+        self._connection.execute('CREATE TABLE configuration_migrated (key TEXT PRIMARY KEY, value TEXT)')
+        self._connection.execute('INSERT OR REPLACE INTO configuration_migrated (key, value) '
+                                 'SELECT key, value FROM configuration WHERE key IS NOT NULL ORDER BY rowid')
+        self._connection.execute('DROP TABLE configuration')
+        self._connection.execute('ALTER TABLE configuration_migrated RENAME TO configuration')
+
+    def _migrate_playlist_tracks(self):
+        """
+        Databases created by earlier versions store the playlist indexes as a row per track ID. If that table is found
+        each playlist's tracks are converted to a `TrackArchive` and the table is dropped. Any IDs that are not Spotify
+        track IDs cannot be stored in an archive and are dropped.
+        """
+        tables = self._connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                          "AND name = 'playlist_tracks'").fetchall()
+
+        if len(tables) == 0:
+            return
+
+        archives = {}
+
+        for playlist_id, track_id in self._connection.execute('SELECT playlist_id, track_id FROM playlist_tracks'):
+            if is_track_id(track_id):
+                archives.setdefault(playlist_id, []).append(track_id)
+
+        for playlist_id, track_ids in archives.items():
+            archive = TrackArchive()
+            archive.update(track_ids)
+            self._connection.execute('INSERT OR REPLACE INTO playlist_archives (playlist_id, track_ids) VALUES (?, ?)',
+                                     (playlist_id, archive.to_bytes()))
+
+        self._connection.execute('DROP TABLE playlist_tracks')
+
+    def close(self):
+        """
+        Closes the connection to the SQLite database.
+        """
+        with self._lock:
+            self._connection.close()
 
     def get_value(self, key):
         """
@@ -27,19 +107,23 @@ class DatabaseClient:
         :param key:
         :return:
         """
-        connection = self._connect()
-
-        with connection:
-            cursor = connection.cursor()
-            cursor.execute('SELECT value FROM configuration WHERE key = ?', (key,))
-            config_value = cursor.fetchone()
+        return self.get_many([key]).get(key)
 
-        connection.close()
+    def get_many(self, keys):
+        """
+        Retrieves the values corresponding with each of `keys` from the database in a single query. A dictionary of the
+        keys that are present and their values is returned.
 
-        if config_value is None:
-            return config_value
+        :param keys:
+        :return:
+        """
+        keys = list(keys)
+        placeholders = ', '.join('?' for _ in keys)
 
-        return config_value[0]
+        with self._lock:
+            cursor = self._connection.execute(f'SELECT key, value FROM configuration WHERE key IN ({placeholders})',
+                                              keys)
+            return dict(cursor.fetchall())
 
     def set_value(self, key, value):
         """
@@ -49,15 +133,243 @@ class DatabaseClient:
         :param key:
         :param value:
         """
-        connection = self._connect()
+        self.set_many({key: value})
+
+    def set_many(self, values):
+        """
+        Sets each key in the dictionary `values` to its corresponding value in a single transaction. Keys that do not
+        exist are automatically added and simply updated if they already exist.
 
-        with connection:
-            cursor = connection.cursor()
-            cursor.execute('SELECT value FROM configuration WHERE key = ?', (key,))
+        :param values:
+        """
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT INTO configuration (key, value) VALUES (?, ?) '
+                                         'ON CONFLICT (key) DO UPDATE SET value = excluded.value', values.items())
 
-            if cursor.fetchone() is None:
-                connection.execute('INSERT INTO configuration (key, value) VALUES (?, ?)', (key, value))
-            else:
-                connection.execute('UPDATE configuration SET value = ? WHERE key = ?', (value, key))
+    def get_playlist_ids(self, names):
+        """
+        Retrieves the cached playlist IDs for each of the playlist `names`. A dictionary of the names that are cached
+        and their playlist IDs is returned.
 
-        connection.close()
+        :param names:
+        :return:
+        """
+        names = list(names)
+        placeholders = ', '.join('?' for _ in names)
+
+        with self._lock:
+            cursor = self._connection.execute(f'SELECT name, playlist_id FROM playlist_names '
+                                              f'WHERE name IN ({placeholders})', names)
+            return dict(cursor.fetchall())
+
+    def set_playlist_ids(self, playlist_ids):
+        """
+        Caches the playlist ID for each playlist name in the dictionary `playlist_ids`.
+
+        :param playlist_ids:
+        """
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT INTO playlist_names (name, playlist_id) VALUES (?, ?) '
+                                         'ON CONFLICT (name) DO UPDATE SET playlist_id = excluded.playlist_id',
+                                         playlist_ids.items())
+
+    def delete_playlist_ids(self, names):
+        """
+        Removes the cached playlist IDs for each of the playlist `names`.
+
+        :param names:
+        """
+        with self._lock, self._connection:
+            self._connection.executemany('DELETE FROM playlist_names WHERE name = ?', ((name,) for name in names))
+
+    def get_playlist_snapshot(self, playlist_id):
+        """
+        Retrieves the last seen `snapshot_id` and track count for `playlist_id` as a tuple if the playlist has been
+        indexed previously.
+
+        :param playlist_id:
+        :return:
+        """
+        with self._lock:
+            cursor = self._connection.execute('SELECT snapshot_id, track_count FROM playlist_snapshots '
+                                              'WHERE playlist_id = ?', (playlist_id,))
+            return cursor.fetchone()
+
+    def get_playlist_track_ids(self, playlist_id):
+        """
+        Returns the `TrackArchive` of track IDs stored in the local index for `playlist_id`.
+
+        :param playlist_id:
+        :return:
+        """
+        with self._lock:
+            return self._get_playlist_archive(playlist_id)
+
+    def _get_playlist_archive(self, playlist_id):
+        cursor = self._connection.execute('SELECT track_ids FROM playlist_archives WHERE playlist_id = ?',
+                                          (playlist_id,))
+        row = cursor.fetchone()
+
+        return TrackArchive(row[0]) if row is not None else TrackArchive()
+
+    def add_playlist_tracks(self, playlist_id, track_ids, snapshot_id, track_count, replace=False):
+        """
+        Adds `track_ids` to the local index for `playlist_id` and records `snapshot_id` and `track_count` as the state
+        of the playlist the index now reflects. If `replace` is set any previously indexed tracks are removed first.
+
+        :param playlist_id:
+        :param track_ids:
+        :param snapshot_id:
+        :param track_count:
+        :param replace:
+        """
+        with self._lock, self._connection:
+            self._add_playlist_tracks(playlist_id, track_ids, snapshot_id, track_count, replace)
+
+    def _add_playlist_tracks(self, playlist_id, track_ids, snapshot_id, track_count, replace=False):
+        archive = TrackArchive() if replace else self._get_playlist_archive(playlist_id)
+        archive.update(track_ids)
+        self._connection.execute('INSERT INTO playlist_archives (playlist_id, track_ids) VALUES (?, ?) '
+                                 'ON CONFLICT (playlist_id) DO UPDATE SET track_ids = excluded.track_ids',
+                                 (playlist_id, archive.to_bytes()))
+        self._connection.execute('INSERT INTO playlist_snapshots (playlist_id, snapshot_id, track_count) '
+                                 'VALUES (?, ?, ?) ON CONFLICT (playlist_id) DO UPDATE SET '
+                                 'snapshot_id = excluded.snapshot_id, track_count = excluded.track_count',
+                                 (playlist_id, snapshot_id, track_count))
+
+    def get_merged_index(self, name):
+        """
+        Retrieves the signature and `TrackArchive` of the merged index stored under `name` as a tuple if one is present.
+
+        :param name:
+        :return:
+        """
+        with self._lock:
+            cursor = self._connection.execute('SELECT signature, track_ids FROM merged_indexes WHERE name = ?', (name,))
+            row = cursor.fetchone()
+
+        return (row[0], TrackArchive(row[1])) if row is not None else None
+
+    def set_merged_index(self, name, signature, archive):
+        """
+        Stores `archive` as the merged index under `name`, along with the `signature` describing the indexes it was
+        merged from.
+
+        :param name:
+        :param signature:
+        :param archive:
+        """
+        with self._lock, self._connection:
+            self._connection.execute('INSERT INTO merged_indexes (name, signature, track_ids) VALUES (?, ?, ?) '
+                                     'ON CONFLICT (name) DO UPDATE SET signature = excluded.signature, '
+                                     'track_ids = excluded.track_ids', (name, signature, archive.to_bytes()))
+
+    def get_cached_response(self, key):
+        """
+        Retrieves the ETag and body of the cached response stored under `key` as a tuple if one is present.
+
+        :param key:
+        :return:
+        """
+        with self._lock:
+            cursor = self._connection.execute('SELECT etag, body FROM response_cache WHERE key = ?', (key,))
+            return cursor.fetchone()
+
+    def touch_cached_response(self, key, last_used):
+        """
+        Records that the cached response stored under `key` was used at `last_used`.
+
+        :param key:
+        :param last_used:
+        """
+        with self._lock, self._connection:
+            self._connection.execute('UPDATE response_cache SET last_used = ? WHERE key = ?', (last_used, key))
+
+    def set_cached_response(self, key, etag, body, last_used, max_size):
+        """
+        Caches the response `body` and its `etag` under `key`. Once the total size of the cached bodies exceeds
+        `max_size` bytes the least recently used responses are evicted.
+
+        :param key:
+        :param etag:
+        :param body:
+        :param last_used:
+        :param max_size:
+        """
+        with self._lock, self._connection:
+            self._connection.execute('INSERT INTO response_cache (key, etag, body, size, last_used) '
+                                     'VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET etag = excluded.etag, '
+                                     'body = excluded.body, size = excluded.size, last_used = excluded.last_used',
+                                     (key, etag, body, len(body), last_used))
+            self._connection.execute('DELETE FROM response_cache WHERE key IN (SELECT key FROM '
+                                     '(SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS total_size '
+                                     'FROM response_cache) WHERE total_size > ?)', (max_size,))
+
+    def journal_writes(self, playlist_id, chunks, base_snapshot_id):
+        """
+        Records each chunk of track URIs in `chunks` as a pending write to `playlist_id`, replacing any previous journal
+        for the playlist. `base_snapshot_id` is the snapshot of the playlist the writes are applied on top of.
+
+        :param playlist_id:
+        :param chunks:
+        :param base_snapshot_id:
+        """
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM write_journal WHERE playlist_id = ?', (playlist_id,))
+            self._connection.executemany('INSERT INTO write_journal (playlist_id, chunk_index, track_uris, '
+                                         'base_snapshot_id) VALUES (?, ?, ?, ?)',
+                                         ((playlist_id, index, json.dumps(chunk), base_snapshot_id)
+                                          for index, chunk in enumerate(chunks)))
+
+    def get_journal(self, playlist_id):
+        """
+        Returns the journalled writes to `playlist_id` in order as a list of tuples containing each chunk's index, track
+        URIs, base snapshot and, once the chunk has been written, the `snapshot_id` returned by the API.
+
+        :param playlist_id:
+        :return:
+        """
+        with self._lock:
+            cursor = self._connection.execute('SELECT chunk_index, track_uris, base_snapshot_id, snapshot_id '
+                                              'FROM write_journal WHERE playlist_id = ? ORDER BY chunk_index',
+                                              (playlist_id,))
+            return [(index, json.loads(track_uris), base_snapshot_id, snapshot_id)
+                    for index, track_uris, base_snapshot_id, snapshot_id in cursor]
+
+    def complete_journal_chunk(self, playlist_id, chunk_index, snapshot_id, track_ids):
+        """
+        Marks the journalled chunk `chunk_index` of `playlist_id` as written, recording the resulting `snapshot_id`. If
+        the playlist has been indexed the chunk's `track_ids` are appended to its index, with `snapshot_id` recorded as
+        the state the index now reflects, in the same transaction so that the journal and the index always agree. The
+        playlist's new track count is returned, or `None` if it has not been indexed.
+
+        :param playlist_id:
+        :param chunk_index:
+        :param snapshot_id:
+        :param track_ids:
+        :return:
+        """
+        with self._lock, self._connection:
+            self._connection.execute('UPDATE write_journal SET snapshot_id = ? '
+                                     'WHERE playlist_id = ? AND chunk_index = ?',
+                                     (snapshot_id, playlist_id, chunk_index))
+            cursor = self._connection.execute('SELECT track_count FROM playlist_snapshots WHERE playlist_id = ?',
+                                              (playlist_id,))
+            row = cursor.fetchone()
+
+            if row is None:
+                return None
+
+            track_count = row[0] + len(track_ids)
+            self._add_playlist_tracks(playlist_id, track_ids, snapshot_id, track_count)
+
+        return track_count
+
+    def clear_journal(self, playlist_id):
+        """
+        Removes the write journal of `playlist_id`.
+
+        :param playlist_id:
+        """
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM write_journal WHERE playlist_id = ?', (playlist_id,))
@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLEEP_REASONS = ('rate_limit', 'backoff', 'pacing')
+METRIC_PREFIX = 'discoverindefinitely'
+TEMPLATED_SEGMENTS = ('playlists', 'users')
+
+
+def endpoint_template(endpoint):
+    """
+    Converts an API `endpoint` to a template by replacing the ID following a collection segment with `{id}`, so that
+    requests for different playlists are recorded against the same endpoint.
+
+    :param endpoint:
+    :return:
+    """
+    segments = endpoint.split('/')
+
+    for index in range(1, len(segments)):
+        if segments[index - 1] in TEMPLATED_SEGMENTS:
+            segments[index] = '{id}'
+
+    return '/'.join(segments)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._run_info = {}
+        self._cache_results = {'hits': 0, 'misses': 0}
+        self._started_at = time.time()
+
+    def _endpoint(self, method, endpoint):
+        key = (method, endpoint_template(endpoint))
+
+        if key not in self._endpoints:
+            self._endpoints[key] = {
+                'requests': 0,
+                'status_codes': {},
+                'latency_buckets': [0] * len(LATENCY_BUCKETS),
+                'latency_sum': 0,
+                'response_bytes': 0,
+                'retries': 0,
+                'connection_errors': 0,
+                'sleep_seconds': {reason: 0 for reason in SLEEP_REASONS}
+            }
+
+        return self._endpoints[key]
+
+    def record_request(self, method, endpoint, status_code, latency, response_bytes):
+        """
+        Records a completed request to `endpoint`.
+
+        :param method:
+        :param endpoint:
+        :param status_code:
+        :param latency:
+        :param response_bytes:
+        """
+        with self._lock:
+            metrics = self._endpoint(method, endpoint)
+            metrics['requests'] += 1
+            metrics['status_codes'][status_code] = metrics['status_codes'].get(status_code, 0) + 1
+            metrics['latency_sum'] += latency
+            metrics['response_bytes'] += response_bytes
+
+            for index, bucket in enumerate(LATENCY_BUCKETS):
+                if latency <= bucket:
+                    metrics['latency_buckets'][index] += 1
+
+    def record_connection_error(self, method, endpoint):
+        """
+        Records a request to `endpoint` that failed before a response was received.
+
+        :param method:
+        :param endpoint:
+        """
+        with self._lock:
+            self._endpoint(method, endpoint)['connection_errors'] += 1
+
+    def record_retry(self, method, endpoint):
+        """
+        Records that a request to `endpoint` is being retried.
+
+        :param method:
+        :param endpoint:
+        """
+        with self._lock:
+            self._endpoint(method, endpoint)['retries'] += 1
+
+    def record_sleep(self, method, endpoint, reason, seconds):
+        """
+        Records time spent waiting before a request to `endpoint` could be sent. `reason` is one of `rate_limit` for
+        waits imposed by a `Retry-After` header, `backoff` for waits after a failed request and `pacing` for waits on
+        the client's own request budget.
+
+        :param method:
+        :param endpoint:
+        :param reason:
+        :param seconds:
+        """
+        if seconds > 0:
+            with self._lock:
+                self._endpoint(method, endpoint)['sleep_seconds'][reason] += seconds
+
+    def record_cache_result(self, hit):
+        """
+        Records whether a cacheable GET request was answered from the response cache, `hit`, or had to be retrieved in
+        full.
+
+        :param hit:
+        """
+        with self._lock:
+            self._cache_results['hits' if hit else 'misses'] += 1
+
+    def set_run_info(self, **run_info):
+        """
+        Adds information about the run, such as the number of tracks added, to the report.
+
+        :param run_info:
+        """
+        with self._lock:
+            self._run_info.update(run_info)
+
+    def to_dict(self):
+        """
+        Returns the recorded metrics as a JSON serialisable dictionary.
+
+        :return:
+        """
+        with self._lock:
+            endpoints = []
+
+            for (method, endpoint), metrics in sorted(self._endpoints.items()):
+                endpoint_metrics = json.loads(json.dumps(metrics))
+                endpoint_metrics['latency_buckets'] = dict(zip(map(str, LATENCY_BUCKETS), metrics['latency_buckets']))
+                endpoints.append({'method': method, 'endpoint': endpoint, **endpoint_metrics})
+
+            return {
+                'started_at': self._started_at,
+                'duration_seconds': time.time() - self._started_at,
+                'cache_hits': self._cache_results['hits'],
+                'cache_misses': self._cache_results['misses'],
+                **self._run_info,
+                'endpoints': endpoints
+            }
+
+    def write_json(self, path):
+        """
+        Writes the recorded metrics to `path` as JSON.
+
+        :param path:
+        """
+        self._write_atomic(path, json.dumps(self.to_dict(), indent=4))
+
+    def write_prometheus(self, path):
+        """
+        Writes the recorded metrics to `path` in the Prometheus text exposition format, suitable for the node exporter's
+        textfile collector.
+
+        :param path:
+        """
+        report = self.to_dict()
+        families = {
+            'requests_total': ('counter', []),
+            'request_duration_seconds': ('histogram', []),
+            'response_bytes_total': ('counter', []),
+            'retries_total': ('counter', []),
+            'connection_errors_total': ('counter', []),
+            'sleep_seconds_total': ('counter', [])
+        }
+
+        for metrics in report['endpoints']:
+            labels = f'method="{metrics["method"]}",endpoint="{metrics["endpoint"]}"'
+            histogram = families['request_duration_seconds'][1]
+
+            for status_code, count in metrics['status_codes'].items():
+                families['requests_total'][1].append((f'{{{labels},status="{status_code}"}}', count))
+
+            for bucket, count in metrics['latency_buckets'].items():
+                histogram.append((f'_bucket{{{labels},le="{bucket}"}}', count))
+
+            histogram.append((f'_bucket{{{labels},le="+Inf"}}', metrics['requests']))
+            histogram.append((f'_sum{{{labels}}}', metrics['latency_sum']))
+            histogram.append((f'_count{{{labels}}}', metrics['requests']))
+            families['response_bytes_total'][1].append((f'{{{labels}}}', metrics['response_bytes']))
+            families['retries_total'][1].append((f'{{{labels}}}', metrics['retries']))
+            families['connection_errors_total'][1].append((f'{{{labels}}}', metrics['connection_errors']))
+
+            for reason, seconds in metrics['sleep_seconds'].items():
+                families['sleep_seconds_total'][1].append((f'{{{labels},reason="{reason}"}}', seconds))
+
+        families['run_duration_seconds'] = ('gauge', [('', report['duration_seconds'])])
+        families['last_run_timestamp_seconds'] = ('gauge', [('', report['started_at'])])
+
+        for key, value in report.items():
+            if key not in ('started_at', 'duration_seconds', 'endpoints') and isinstance(value, (int, float)):
+                families[f'run_{key}'] = ('gauge', [('', value)])
+
+        lines = []
+
+        for name, (metric_type, samples) in families.items():
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} {metric_type}')
+            lines.extend(f'{METRIC_PREFIX}_{name}{suffix} {value}' for suffix, value in samples)
+
+        self._write_atomic(path, '\n'.join(lines) + '\n')
+
+    @staticmethod
+    def _write_atomic(path, content):
+        """
+        Writes `content` to a temporary file alongside `path` then renames it into place, so that readers such as the
+        textfile collector never see a partially written file.
+
+        :param path:
+        :param content:
+        """
+        path = Path(path)
+        temporary_path = path.with_name(f'.{path.name}.tmp')
+        temporary_path.write_text(content)
+        os.replace(temporary_path, path)
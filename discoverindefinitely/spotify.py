@@ -1,23 +1,385 @@
+import json
 import math
+import random
+import threading
 import time
 from urllib.parse import urlencode
 
-import requests
-
-from discoverindefinitely.auth_server import AuthorisationServer
-from discoverindefinitely.database import DatabaseClient
+from discoverindefinitely.archive import TrackArchive, is_track_id
+from discoverindefinitely.cache import ResponseCache
+from discoverindefinitely.metrics import RequestMetrics
+from discoverindefinitely.tracing import Tracer
 
 ERROR_MSG_TOKEN_EXPIRED = 'The access token expired'
+TOKEN_REFRESH_MARGIN = 60
+FIELD_PROJECTIONS = {
+    'ids': 'items(track(id))',
+    'uri_id': 'items(track(id,uri))',
+    'added_at': 'items(added_at,track(id))'
+}
+
+
+_json_decoder = None
+
+
+def json_loads(data):
+    """
+    Decodes the JSON document `data`. If orjson is installed it is used as it is faster than Python's built-in decoder
+    for large responses, otherwise the built-in decoder is used. The decoder is chosen on first use so that importing
+    this module does not pay for importing orjson.
+
+    :param data:
+    :return:
+    """
+    global _json_decoder
+
+    if _json_decoder is None:
+        try:
+            from orjson import loads as _json_decoder
+        except ImportError:
+            _json_decoder = json.loads
+
+    return _json_decoder(data)
+
+
+class SpotifyError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UncertainWriteError(SpotifyError):
+    pass
+
+
+class RequestScheduler:
+    def __init__(self, requests_per_second=10, burst=20, max_attempts=10, backoff_base=1, backoff_cap=60):
+        self.max_attempts = max_attempts
+        self._rate = requests_per_second
+        self._capacity = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._backoff_base = backoff_base
+        self._backoff_cap = backoff_cap
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks the calling thread until a request may be sent. Requests are paced by a token bucket that refills at
+        `requests_per_second` and allows bursts of up to `burst` requests, and are held back entirely while the API has
+        rate limited the client. The scheduler is shared between all threads using a client so concurrent requests draw
+        from the same budget and back off together.
+
+        The time spent waiting for the rate limit to expire and the time spent waiting on the request budget are
+        returned as a tuple.
+
+        :return:
+        """
+        rate_limited = 0
+        paced = 0
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+
+                if self._blocked_until > now:
+                    timeout = self._blocked_until - now
+                    rate_limited += timeout
+                else:
+                    self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                    self._updated = now
+
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return rate_limited, paced
+
+                    timeout = (1 - self._tokens) / self._rate
+                    paced += timeout
+
+            time.sleep(timeout)
+
+    def block(self, timeout):
+        """
+        Records that the API has rate limited the client for `timeout` seconds. No requests are granted by `acquire`
+        until the deadline has passed.
+
+        :param timeout:
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + timeout)
+            self._tokens = 0
+            self._updated = self._blocked_until
+
+    def backoff(self, attempt):
+        """
+        Sleeps for a random period of up to `backoff_base * 2 ** attempt` seconds, capped at `backoff_cap`, before a
+        failed request is retried. The time slept is returned.
+
+        :param attempt:
+        :return:
+        """
+        timeout = random.uniform(0, min(self._backoff_cap, self._backoff_base * 2 ** attempt))
+        time.sleep(timeout)
+
+        return timeout
 
 
 class SpotifyClient:
-    def __init__(self, client_id, client_secret):
+    def __init__(self, client_id, client_secret, pool_size=10, max_retries=3, max_workers=4, scheduler=None,
+                 api_url='https://api.spotify.com/v1/', accounts_url='https://accounts.spotify.com/',
+                 database_path=None, cache_size=50 * 1024 * 1024, auth_port=8080, auth_timeout=300, tracer=None,
+                 timeout=(5, 30), log=print):
         self._client_id = client_id
         self._client_secret = client_secret
-        self._api_url = 'https://api.spotify.com/v1/'
-        self._db_client = DatabaseClient()
-        self._access_token = self._db_client.get_value('access_token')
-        self._authorise()
+        self._api_url = api_url
+        self._accounts_url = accounts_url
+        self._max_workers = max_workers
+        self._auth_port = auth_port
+        self._auth_timeout = auth_timeout
+        self._timeout = timeout
+        self._scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self.metrics = RequestMetrics()
+        self.tracer = tracer if tracer is not None else Tracer(enabled=False)
+        self.log = log
+        self._playlist_indexes = {}
+        self._pool_size = pool_size
+        self._max_retries = max_retries
+        self._database_path = database_path
+        self._http_session = None
+        self._database = None
+        self._init_lock = threading.RLock()
+        self._response_cache = ResponseCache(lambda: self._db_client, cache_size, json_loads)
+        self._token_lock = threading.Lock()
+        self._authorised = False
+        self._access_token = None
+        self._refresh_token = None
+        self._token_expires_at = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def _session(self):
+        """
+        The HTTP session, created along with the HTTP stack it depends on when it is first used.
+
+        :return:
+        """
+        if self._http_session is None:
+            with self._init_lock:
+                if self._http_session is None:
+                    self._http_session = self._create_session(self._pool_size, self._max_retries)
+
+        return self._http_session
+
+    @property
+    def _db_client(self):
+        """
+        The client for the local database, which is opened and has its schema created when it is first used.
+
+        :return:
+        """
+        if self._database is None:
+            with self._init_lock:
+                if self._database is None:
+                    from discoverindefinitely.database import DatabaseClient
+
+                    self._database = DatabaseClient(self._database_path)
+
+        return self._database
+
+    @staticmethod
+    def _create_session(pool_size, max_retries):
+        """
+        Creates the HTTP session shared by all API and token requests so that connections to the Spotify API and
+        Accounts service are kept alive and reused rather than being re-established for every request.
+
+        `pool_size` sets the maximum number of connections kept open per host. `max_retries` sets how many times a
+        request is retried when a connection cannot be established, it does not retry on response status codes as
+        those are handled by the request methods.
+
+        :param pool_size:
+        :param max_retries:
+        :return:
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=max_retries, connect=max_retries, read=0, status=0, backoff_factor=0.5,
+                      allowed_methods=None, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        return session
+
+    def close(self):
+        """
+        Closes the HTTP session, releasing any pooled connections, and the connection to the database if either has been
+        opened.
+        """
+        if self._http_session is not None:
+            self._http_session.close()
+
+        if self._database is not None:
+            self._database.close()
+
+    def _api_request(self, method, endpoint, params=None, json_data=None):
+        """
+        Performs a request against the Spotify API, retrying it until it succeeds or the scheduler's maximum number of
+        attempts is exhausted. Every attempt waits for the scheduler to grant it a slot in the request budget. The
+        resulting API response is returned in full.
+
+        The access token is refreshed shortly before it is due to expire. If the API response nevertheless indicates the
+        access token has expired the application will attempt to perform the refresh process automatically.
+
+        If the API response states that the application has been rate limited all requests made through the scheduler
+        are held back for the time stated in the `Retry-After` header. Server errors and connection failures are retried
+        with a jittered exponential backoff. Any other error response, or running out of attempts, raises a
+        `SpotifyError` describing the failure. Every request is sent with the client's `(connect, read)` timeout, so a
+        stalled connection fails and is retried like any other connection failure rather than blocking indefinitely.
+
+        POST requests are not idempotent, so they are only retried when they were rate limited or the connection could
+        not be established. If a POST fails in a way that means it may have been applied an `UncertainWriteError` is
+        raised instead, leaving the caller to check whether it was.
+
+        GET responses that carry an ETag are cached. When the same request is repeated the cached ETag is sent in the
+        `If-None-Match` header and if the API reports the resource has not been modified the cached body is returned.
+        Recently used bodies are kept decoded in memory, so an unchanged response is usually not decoded again and the
+        same object is returned to every request that reuses it. Responses must therefore not be modified by callers.
+
+        :param method:
+        :param endpoint:
+        :param params:
+        :param json_data:
+        :return:
+        """
+        import requests
+
+        url = f'{self._api_url}{endpoint}'
+        cache_key = None
+        cached_response = None
+
+        if method == 'GET' and self._response_cache.enabled:
+            cache_key = ResponseCache.get_key(url, params)
+            cached_response = self._response_cache.get(cache_key)
+
+        for attempt in range(self._scheduler.max_attempts):
+            if attempt > 0:
+                self.metrics.record_retry(method, endpoint)
+
+            wait_start = time.perf_counter()
+            rate_limited, paced = self._scheduler.acquire()
+            self.metrics.record_sleep(method, endpoint, 'rate_limit', rate_limited)
+            self.metrics.record_sleep(method, endpoint, 'pacing', paced)
+
+            if rate_limited + paced > 0:
+                self.tracer.add_span('throttle', wait_start, time.perf_counter() - wait_start, endpoint=endpoint,
+                                     rate_limit=rate_limited, pacing=paced)
+
+            access_token = self._get_access_token()
+            headers = {
+                'Authorization': f'Bearer {access_token}'
+            }
+
+            if cached_response is not None:
+                headers['If-None-Match'] = cached_response[0]
+
+            start = time.perf_counter()
+
+            try:
+                response = self._session.request(method, url, headers=headers, params=params, json=json_data,
+                                                 timeout=self._timeout)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                self.metrics.record_connection_error(method, endpoint)
+
+                if method == 'POST' and not self._is_connect_error(error):
+                    raise UncertainWriteError(f'Request to {endpoint} failed after it was sent: {error}')
+
+                self.log(f'Request failed: {error}')
+                self._backoff(method, endpoint, attempt)
+                continue
+
+            latency = time.perf_counter() - start
+            self.metrics.record_request(method, endpoint, response.status_code, latency, len(response.content))
+            self.tracer.add_span('request', start, latency, method=method, endpoint=endpoint,
+                                 status=response.status_code)
+
+            if response.status_code == 304 and cached_response is not None:
+                self.metrics.record_cache_result(True)
+                return self._response_cache.hit(cache_key, cached_response)
+            elif response.ok:
+                if cache_key is None:
+                    return json_loads(response.content)
+
+                self.metrics.record_cache_result(False)
+                return self._response_cache.miss(cache_key, response.headers.get('ETag'), response.content)
+            elif response.status_code == 401 and self._is_token_expired(response):
+                self._refresh_authorisation(access_token)
+            elif response.status_code == 429:
+                timeout = int(response.headers.get('Retry-After', 1))
+                self.log(f'Rate limited. Waiting: {timeout} seconds')
+                self._scheduler.block(timeout)
+            elif response.status_code >= 500 and method == 'POST':
+                raise UncertainWriteError(f'Request to {endpoint} failed with status {response.status_code}',
+                                          response.status_code)
+            elif response.status_code >= 500:
+                self._backoff(method, endpoint, attempt)
+            else:
+                raise SpotifyError(f'Request to {endpoint} failed with status {response.status_code}: {response.text}',
+                                   response.status_code)
+
+        raise SpotifyError(f'Request to {endpoint} failed after {self._scheduler.max_attempts} attempts')
+
+    def _backoff(self, method, endpoint, attempt):
+        """
+        Waits before retrying a failed request to `endpoint` and records the time spent waiting.
+
+        :param method:
+        :param endpoint:
+        :param attempt:
+        """
+        with self.tracer.span('backoff', endpoint=endpoint, attempt=attempt):
+            self.metrics.record_sleep(method, endpoint, 'backoff', self._scheduler.backoff(attempt))
+
+    @staticmethod
+    def _is_connect_error(error):
+        """
+        Determines whether a failed request failed while establishing the connection, in which case none of the request
+        can have reached the API.
+
+        :param error:
+        :return:
+        """
+        import requests
+        from urllib3.exceptions import ConnectTimeoutError
+
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+
+        reason = getattr(error.args[0], 'reason', None) if len(error.args) > 0 else None
+
+        # urllib3 reports refused and unreachable connections with `NewConnectionError`, a `ConnectTimeoutError`.
+        return isinstance(reason, ConnectTimeoutError)
+
+    @staticmethod
+    def _is_token_expired(response):
+        """
+        Determines whether an unauthorised API response was caused by the access token expiring.
+
+        :param response:
+        :return:
+        """
+        try:
+            return response.json()['error']['message'] == ERROR_MSG_TOKEN_EXPIRED
+        except (ValueError, KeyError, TypeError):
+            return False
 
     def _api_query_request(self, endpoint, data=None):
         """
@@ -25,36 +387,11 @@ class SpotifyClient:
         by the calling operation and if `data` is set then it is passed to the request for use as GET parameters. The
         resulting API response is returned in full.
 
-        If the API response indicates the access token has expired the application will attempt to perform the refresh
-        process automatically.
-
-        If the API response states that the application has been rate limited it will wait for the time state in the
-        `Retry-After` header plus an extra 10 seconds for safety.
-
         :param endpoint:
         :param data:
         :return:
         """
-        auth_header = {
-            'Authorization': f'Bearer {self._access_token}'
-        }
-        response = requests.get(f'{self._api_url}{endpoint}', headers=auth_header, params=data)
-        response_data = response.json()
-
-        if response.ok:
-            return response_data
-        elif response.status_code == 401 and response_data['error']['message'] == ERROR_MSG_TOKEN_EXPIRED:
-            self._refresh_authorisation()
-            return self._api_query_request(endpoint, data)
-        elif response.status_code == 429:
-            timeout = int(response.headers['Retry-After']) + 10
-            print(f'Rate limited. Waiting: {timeout} seconds')
-            time.sleep(timeout)
-            return self._api_query_request(endpoint, data)
-        else:
-            print('An unexpected error has occurred')
-            print(response.text)
-            exit(1)
+        return self._api_request('GET', endpoint, params=data)
 
     def _api_update_request(self, endpoint, data):
         """
@@ -62,37 +399,11 @@ class SpotifyClient:
         by the calling operation and if `data` is set then it is pass to the request as the JSON body. The resulting API
         response is returned in full.
 
-        If the API response indicates the access token has expired the application will attempt to perform the refresh
-        process automatically.
-
-        If the API response states that the application has been rate limited it will wait for the time state in the
-        `Retry-After` header plus an extra 10 seconds for safety.
-
         :param endpoint:
         :param data:
         :return:
         """
-        headers = {
-            'Authorization': f'Bearer {self._access_token}',
-            'Content-Type': 'application/json'
-        }
-        response = requests.post(f'{self._api_url}{endpoint}', headers=headers, json=data)
-        response_data = response.json()
-
-        if response.ok:
-            return response_data
-        elif response.status_code == 401 and response_data['error']['message'] == ERROR_MSG_TOKEN_EXPIRED:
-            self._refresh_authorisation()
-            return self._api_update_request(endpoint, data)
-        elif response.status_code == 429:
-            timeout = int(response.headers['Retry-After']) + 10
-            print(f'Rate limited. Waiting: {timeout} seconds')
-            time.sleep(timeout)
-            return self._api_update_request(endpoint, data)
-        else:
-            print('An unexpected error has occurred')
-            print(response.text)
-            exit(1)
+        return self._api_request('POST', endpoint, json_data=data)
 
     def _authorise(self):
         """
@@ -100,62 +411,168 @@ class SpotifyClient:
         run when the application is requesting authorisation from a user for the first time. Once the authorisation flow
         has been complete the application should be able to use the acquired refresh token to automatically maintain the
         authorised scope.
-        """
-        redirect_uri = f'http://localhost:8080/callback'
-        token_request_data = {
-            'grant_type': 'authorization_code',
-            'code': self._access_token,
-            'redirect_uri': redirect_uri
-        }
 
+        The callback server listens on `auth_port`, which may be 0 to use an ephemeral port, and a `SpotifyError` is
+        raised if the port cannot be listened on, or if authorisation is declined or not completed within
+        `auth_timeout` seconds.
+        """
         if self._access_token is None:
+            from discoverindefinitely.auth_server import AuthorisationServer
+
+            auth_server = AuthorisationServer(port=self._auth_port, timeout=self._auth_timeout)
+
+            try:
+                auth_server.start()
+            except OSError as error:
+                raise SpotifyError(f'The authorisation callback server could not listen on port {self._auth_port}: '
+                                   f'{error}. Set auth_port to a free port and add the matching redirect URI to your '
+                                   f'Spotify application')
+
             data = {
                 'client_id': self._client_id,
                 'response_type': 'code',
-                'redirect_uri': redirect_uri,
+                'redirect_uri': auth_server.redirect_uri,
                 'scope': 'user-library-read playlist-read-private playlist-modify-public playlist-modify-private'
             }
             query_string = urlencode(data, doseq=True)
 
             print('No existing authorisation code found, use the link below to authorise this application.')
-            print(f'https://accounts.spotify.com/authorize?{query_string}')
+            print(f'{self._accounts_url}authorize?{query_string}')
+
+            auth_code = auth_server.wait()
 
-            auth_server = AuthorisationServer()
-            token_request_data['code'] = auth_server.start()
+            if auth_code is None:
+                raise SpotifyError('Authorisation was not completed')
 
-            token_request_response = requests.post('https://accounts.spotify.com/api/token',
-                                                   data=token_request_data,
-                                                   auth=(self._client_id, self._client_secret))
+            token_request_data = {
+                'grant_type': 'authorization_code',
+                'code': auth_code,
+                'redirect_uri': auth_server.redirect_uri
+            }
+            token_request_response = self._token_request(token_request_data)
 
-            if token_request_response.status_code == 200:
-                response_data = token_request_response.json()
-                self._db_client.set_value('access_token', response_data['access_token'])
-                self._db_client.set_value('refresh_token', response_data['refresh_token'])
-                self._access_token = response_data['access_token']
+            if token_request_response.status_code != 200:
+                raise SpotifyError(f'Authorisation failed with status {token_request_response.status_code}: '
+                                   f'{token_request_response.text}', token_request_response.status_code)
 
-    def _refresh_authorisation(self):
+            self._store_token(token_request_response.json())
+
+    def _token_request(self, data):
         """
-        Uses the stored refresh token to retrieve an updated access token from the API when the previous token expires.
-        If the API sends a new refresh token it is also updated.
+        Performs a POST request against the Spotify Accounts service's token endpoint using the client credentials and
+        returns the response. A `SpotifyError` is raised if the request fails or times out before a response arrives.
+
+        :param data:
+        :return:
         """
-        refresh_token = self._db_client.get_value('refresh_token')
+        import requests
 
-        if refresh_token is not None:
-            refresh_request_data = {
-                'grant_type': 'refresh_token',
-                'refresh_token': refresh_token
-            }
-            refresh_request_response = requests.post('https://accounts.spotify.com/api/token',
-                                                     data=refresh_request_data,
-                                                     auth=(self._client_id, self._client_secret))
+        start = time.perf_counter()
+
+        try:
+            response = self._session.post(f'{self._accounts_url}api/token', data=data,
+                                          auth=(self._client_id, self._client_secret), timeout=self._timeout)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            self.metrics.record_connection_error('POST', 'api/token')
+            raise SpotifyError(f'Request to api/token failed: {error}')
 
-            if refresh_request_response.status_code == 200:
-                response_data = refresh_request_response.json()
-                self._db_client.set_value('access_token', response_data['access_token'])
-                self._access_token = response_data['access_token']
+        self.metrics.record_request('POST', 'api/token', response.status_code, time.perf_counter() - start,
+                                    len(response.content))
 
-                if 'refresh_token' in response_data:
-                    self._db_client.set_value('refresh_token', response_data['refresh_token'])
+        return response
+
+    def _load_token(self):
+        """
+        Loads the stored access and refresh tokens into the client's cache and calculates the time at which the access
+        token expires from the `expires_in` value and issue time saved when it was acquired. If either value is unknown
+        the expiry is left unset and an expired token is only detected when the API rejects it.
+        """
+        token = self._db_client.get_many(['access_token', 'refresh_token', 'token_expires_in', 'token_issued_at'])
+        self._access_token = token.get('access_token')
+        self._refresh_token = token.get('refresh_token')
+
+        if 'token_expires_in' in token and 'token_issued_at' in token:
+            self._token_expires_at = float(token['token_issued_at']) + int(token['token_expires_in'])
+
+    def _store_token(self, response_data):
+        """
+        Saves the access token, its expiry and, if the API sent one, the refresh token from a token response to the
+        database and caches them on the client.
+
+        :param response_data:
+        """
+        issued_at = time.time()
+        token = {
+            'access_token': response_data['access_token'],
+            'token_expires_in': str(response_data['expires_in']),
+            'token_issued_at': str(issued_at)
+        }
+
+        if 'refresh_token' in response_data:
+            token['refresh_token'] = response_data['refresh_token']
+            self._refresh_token = response_data['refresh_token']
+
+        self._db_client.set_many(token)
+        self._access_token = response_data['access_token']
+        self._token_expires_at = issued_at + response_data['expires_in']
+
+    def _ensure_authorised(self):
+        """
+        Loads the stored tokens and, if the application has not been authorised yet, runs the authorisation flow. This
+        is deferred until the first API request so that creating a client is cheap.
+        """
+        if not self._authorised:
+            with self._init_lock:
+                if not self._authorised:
+                    self._load_token()
+                    self._authorise()
+                    self._authorised = True
+
+    def _get_access_token(self):
+        """
+        Returns the cached access token, first refreshing it if it expires within `TOKEN_REFRESH_MARGIN` seconds so that
+        requests are not sent with a token the API is about to reject.
+
+        :return:
+        """
+        self._ensure_authorised()
+        access_token = self._access_token
+        expires_at = self._token_expires_at
+
+        if expires_at is not None and time.time() >= expires_at - TOKEN_REFRESH_MARGIN:
+            self._refresh_authorisation(access_token)
+
+        return self._access_token
+
+    def _refresh_authorisation(self, expired_token=None):
+        """
+        Uses the cached refresh token to retrieve an updated access token from the API when the previous token expires.
+        If the API sends a new refresh token it is also updated. If the refresh is rejected, for example because the
+        refresh token has been revoked, a `SpotifyError` describing the token endpoint's response is raised rather than
+        retrying with a token that cannot work.
+
+        Refreshing is serialised between threads. If `expired_token` is given and another thread has already replaced it
+        by the time the lock is acquired no further refresh is performed.
+
+        :param expired_token:
+        """
+        with self._token_lock:
+            if expired_token is not None and expired_token != self._access_token:
+                return
+
+            if self._refresh_token is not None:
+                refresh_request_data = {
+                    'grant_type': 'refresh_token',
+                    'refresh_token': self._refresh_token
+                }
+                refresh_request_response = self._token_request(refresh_request_data)
+
+                if refresh_request_response.status_code != 200:
+                    raise SpotifyError(f'Refreshing the access token failed with status '
+                                       f'{refresh_request_response.status_code}: {refresh_request_response.text}',
+                                       refresh_request_response.status_code)
+
+                self._store_token(refresh_request_response.json())
 
     def _get_user_id(self):
         """
@@ -165,34 +582,167 @@ class SpotifyClient:
         """
         return self._api_query_request('me')['id']
 
+    @staticmethod
+    def _require_fields(fields, *required_fields):
+        """
+        Adds each of `required_fields` to the field query `fields` if it is not already present. `fields` may also be
+        the name of one of the `FIELD_PROJECTIONS`, which is expanded to its field query. If `fields` is not set the API
+        returns every field and it is left unchanged.
+
+        :param fields:
+        :param required_fields:
+        :return:
+        """
+        fields = FIELD_PROJECTIONS.get(fields, fields)
+
+        if fields is None or len(required_fields) == 0:
+            return fields
+
+        present_fields = fields.split(',')
+        missing_fields = [field for field in required_fields if field not in present_fields]
+
+        return ','.join([fields, *missing_fields])
+
+    def _iter_items(self, endpoint, data, limit):
+        """
+        Lazily yields the items of a paginated API endpoint, requesting each page only once the items of the previous
+        page have been consumed. Pages continue to be requested for as long as the API reports a `next` page, so a
+        consumer that stops iterating early avoids requesting the rest of the collection.
+
+        :param endpoint:
+        :param data:
+        :param limit:
+        :return:
+        """
+        data = dict(data, limit=limit)
+
+        while True:
+            page = self._api_query_request(endpoint, data)
+            yield from page['items']
+
+            if page.get('next') is None or len(page['items']) == 0:
+                break
+
+            data['offset'] += len(page['items'])
+
+    def iter_user_playlists(self, offset=0, limit=50):
+        """
+        Lazily yields the public and private playlists of the authorised user, following the API's pagination.
+
+        :param offset:
+        :param limit:
+        :return:
+        """
+        data = {
+            'offset': offset
+        }
+
+        return self._iter_items('me/playlists', data, limit)
+
     def get_user_playlists(self, offset=0, limit=50):
         """
         Retrieves all public and private playlists for the authorised user by iteratively calling the API until the all
-        playlists are retrieved or until the maximum offset limit of 100 is exceeded.
+        playlists are retrieved.
+
+        :return:
+        """
+        with self.tracer.span('get_user_playlists'):
+            return list(self.iter_user_playlists(offset, limit))
 
+    def get_playlist(self, playlist_id, fields='id,name,uri,snapshot_id,tracks.total'):
+        """
+        Retrieves a single playlist by its ID. `fields` should be a valid field query as defined in the Spotify API
+        documentation.
+
+        :param playlist_id:
+        :param fields:
         :return:
         """
-        user_playlists = []
         data = {
-            'offset': offset,
-            'limit': limit
+            'fields': fields
         }
-        playlists = self._api_query_request('me/playlists', data)
 
-        while len(playlists['items']) > 0:
-            user_playlists.extend(playlists['items'])
-            data['offset'] += 50
+        with self.tracer.span('get_playlist', playlist_id=playlist_id):
+            return self._api_query_request(f'playlists/{playlist_id}', data)
 
-            if data['offset'] > 100:
-                break
+    def find_playlists(self, names):
+        """
+        Finds the playlists named by each of `names` and returns a dictionary indexing them by name. Names without a
+        matching playlist are omitted.
+
+        The ID of every playlist found is cached locally. Cached playlists are retrieved directly by ID and their names
+        are checked against the cache. If a cached playlist no longer exists or has been renamed its ID is dropped from
+        the cache and it is looked up again. The user's full playlist listing is only paged through for names that are
+        not cached, and the first playlist found with a given name is used. The IDs of the other playlists seen while
+        paging through the listing are cached as well, so that later lookups of them can skip the listing.
+
+        Names that could not be found are searched for again on every call, as a playlist can be renamed or followed
+        without the size of the listing changing. The pages of an unchanged listing are answered from the response
+        cache, so a user who does not follow one of the requested playlists only pays for conditional requests.
+
+        :param names:
+        :return:
+        """
+        names = set(names)
+        playlists = {}
+        stale_names = []
+
+        for name, playlist_id in self._db_client.get_playlist_ids(names).items():
+            try:
+                playlist = self.get_playlist(playlist_id)
+            except SpotifyError as error:
+                if error.status_code != 404:
+                    raise
+
+                playlist = None
+
+            if playlist is not None and playlist['name'] == name:
+                playlists[name] = playlist
             else:
-                playlists = self._api_query_request('me/playlists', data)
+                stale_names.append(name)
+
+        if len(stale_names) > 0:
+            self._db_client.delete_playlist_ids(stale_names)
+
+        uncached_names = names - playlists.keys()
+
+        if len(uncached_names) == 0:
+            return playlists
+
+        found_playlists = {}
+        seen_ids = {}
 
-        return user_playlists
+        with self.tracer.span('get_user_playlists'):
+            for playlist in self.iter_user_playlists():
+                seen_ids.setdefault(playlist['name'], playlist['id'])
+
+                if playlist['name'] in uncached_names and playlist['name'] not in found_playlists:
+                    found_playlists[playlist['name']] = playlist
+
+                    if len(found_playlists) == len(uncached_names):
+                        break
+
+        seen_ids.update({name: playlist['id'] for name, playlist in found_playlists.items()})
+        self._db_client.set_playlist_ids({name: playlist_id for name, playlist_id in seen_ids.items()
+                                          if name in found_playlists or name not in names})
+        playlists.update(found_playlists)
+
+        return playlists
+
+    def get_known_playlist_ids(self, names):
+        """
+        Returns a dictionary of the cached playlist ID of each of `names` that has been seen before, without querying
+        the API.
+
+        :param names:
+        :return:
+        """
+        return self._db_client.get_playlist_ids(names)
 
     def make_playlist(self, playlist_name):
         """
-        Creates a new private, non-collaborative playlist named by `playlist_name`.
+        Creates a new private, non-collaborative playlist named by `playlist_name`. The new playlist is recorded in the
+        local index as empty, so tracks added to it are indexed without having to read it back.
 
         :param playlist_name:
         :return:
@@ -202,17 +752,23 @@ class SpotifyClient:
             'name': playlist_name,
             'public': False,
             'collaborative': False,
-            'description': 'A backup of tracks added to Discover Weekly and Release Radar playlists.'
+            'description': 'A backup of tracks added to other playlists, made by Discover Indefinitely.'
         }
+        playlist = self._api_update_request(endpoint, data)
+        self._db_client.set_playlist_ids({playlist_name: playlist['id']})
 
-        return self._api_update_request(endpoint, data)
+        if 'snapshot_id' in playlist:
+            self._db_client.add_playlist_tracks(playlist['id'], [], playlist['snapshot_id'], 0)
+
+        return playlist
 
     def get_playlist_tracks(self, playlist, fields=None, offset=0, limit=100):
         """
         Given a `playlist` object from the Spotify API returns the playlist's track list. `fields`, `offset` and `limit`
         can be specified to tune the query result.
 
-        `fields` should be a valid field query as defined in the Spotify API documentation.
+        `fields` should be a valid field query as defined in the Spotify API documentation or the name of one of the
+        `FIELD_PROJECTIONS`.
 
         `offset` is a 0-index value that tells the API which track within the playlist it should start returning from.
 
@@ -227,7 +783,7 @@ class SpotifyClient:
         playlist_id = playlist['id']
         endpoint = f'playlists/{playlist_id}/tracks'
         data = {
-            'fields': fields,
+            'fields': self._require_fields(fields),
             'offset': offset,
             'limit': limit,
             'market': 'from_token'
@@ -235,29 +791,237 @@ class SpotifyClient:
 
         return self._api_query_request(endpoint, data)['items']
 
+    def iter_playlist_tracks(self, playlist, fields=None, offset=0, limit=100):
+        """
+        Given a `playlist` object from the Spotify API lazily yields the playlist's tracks from `offset` onwards,
+        following the API's pagination one page at a time.
+
+        `fields` should be a valid field query as defined in the Spotify API documentation or the name of one of the
+        `FIELD_PROJECTIONS`, `next` is added to the query automatically if it is not already present.
+
+        :param playlist:
+        :param fields:
+        :param offset:
+        :param limit:
+        :return:
+        """
+        playlist_id = playlist['id']
+        data = {
+            'fields': self._require_fields(fields, 'next'),
+            'offset': offset,
+            'market': 'from_token'
+        }
+
+        return self._iter_items(f'playlists/{playlist_id}/tracks', data, limit)
+
+    def get_all_playlist_tracks(self, playlist, fields=None, offset=0, limit=100):
+        """
+        Given a `playlist` object from the Spotify API returns every track in the playlist from `offset` onwards. The
+        first page is retrieved to determine the playlist's total track count after which all remaining offsets are
+        known, so the remaining pages are retrieved concurrently using up to `max_workers` threads. Tracks are returned
+        in playlist order.
+
+        `fields` should be a valid field query as defined in the Spotify API documentation or the name of one of the
+        `FIELD_PROJECTIONS`, `total` is added to the query automatically if it is not already present.
+
+        :param playlist:
+        :param fields:
+        :param offset:
+        :param limit:
+        :return:
+        """
+        fields = self._require_fields(fields, 'total')
+        playlist_id = playlist['id']
+        endpoint = f'playlists/{playlist_id}/tracks'
+
+        def get_page(page_offset):
+            data = {
+                'fields': fields,
+                'offset': page_offset,
+                'limit': limit,
+                'market': 'from_token'
+            }
+            return self._api_query_request(endpoint, data)
+
+        first_page = get_page(offset)
+        tracks = list(first_page['items'])
+        remaining_offsets = range(offset + limit, first_page['total'], limit)
+
+        if self._max_workers > 1 and len(remaining_offsets) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                pages = list(executor.map(get_page, remaining_offsets))
+        else:
+            pages = [get_page(page_offset) for page_offset in remaining_offsets]
+
+        for page in pages:
+            tracks.extend(page['items'])
+
+        return tracks
+
     def search_playlist(self, track_id, playlist):
         """
-        Retrieves the track listing for `playlist` and iteratively searches for `track_id`. If the playlist contains
-        more than 100 tracks the API will be queried multiple times with an incrementing offset value until the entire
-        playlist has been exhausted. If the track is found in the playlist at any point the search it halted.
+        Iterates over the track listing for `playlist` searching for `track_id`. Pages of the playlist are only
+        retrieved as the search reaches them, so if the track is found the search is halted without requesting the
+        rest of the playlist.
 
         :param track_id:
         :param playlist:
         :return:
         """
-        offset = 0
-        field_query = 'items(track(id))'
-        tracks = self.get_playlist_tracks(playlist, fields=field_query)
+        for track in self.iter_playlist_tracks(playlist, fields='ids'):
+            if track['track'] is not None and track['track']['id'] == track_id:
+                return True
 
-        while len(tracks) > 0:
-            for track in tracks:
-                if track['track']['id'] == track_id:
-                    return True
+        return False
 
-            offset += 100
-            tracks = self.get_playlist_tracks(playlist, fields=field_query, offset=offset)
+    def get_playlist_snapshot(self, playlist):
+        """
+        Queries the API for the current `snapshot_id` and track total of `playlist` without retrieving any tracks.
 
-        return False
+        :param playlist:
+        :return:
+        """
+        playlist_id = playlist['id']
+        data = {
+            'fields': 'snapshot_id,tracks.total'
+        }
+        response_data = self._api_query_request(f'playlists/{playlist_id}', data)
+
+        return response_data['snapshot_id'], response_data['tracks']['total']
+
+    def get_playlist_track_count(self, playlist):
+        """
+        Returns the number of tracks in `playlist`. If the playlist has been indexed by this client the count is taken
+        from its index, otherwise the API is queried.
+
+        :param playlist:
+        :return:
+        """
+        cached_index = self._playlist_indexes.get(playlist['id'])
+
+        if cached_index is not None:
+            return cached_index[1]
+
+        return self.get_playlist_snapshot(playlist)[1]
+
+    def get_playlist_index(self, playlist, snapshot=None):
+        """
+        Builds an index of the track IDs in `playlist` so that membership checks are a lookup in a `TrackArchive` rather
+        than a scan of the playlist through the API. The returned archive can be updated by the caller as tracks are
+        added during a run.
+
+        The index is persisted in the local database along with the playlist's `snapshot_id`. If the API reports the
+        same snapshot as the one last seen the index is returned entirely from local data. If the snapshot has changed
+        but the playlist has not shrunk only the tracks after the last known track count are retrieved, as the
+        destination playlist is only ever appended to. Otherwise the whole playlist is paged through again using a
+        minimal field query, with pages retrieved concurrently. Items without a Spotify track ID, such as local files,
+        are left out of the index.
+
+        The most recent index of each playlist is also kept in memory for the lifetime of the client, so a long running
+        client does not have to read the index back from the database while the playlist is unchanged. A copy of the
+        index is returned so that changes made by the caller do not affect the cached index.
+
+        If the playlist's current `snapshot_id` and track count were returned by an earlier request they can be passed
+        as the tuple `snapshot`, and the API is not queried for them again.
+
+        :param playlist:
+        :param snapshot:
+        :return:
+        """
+        playlist_id = playlist['id']
+        snapshot_id, track_count = snapshot if snapshot is not None else self.get_playlist_snapshot(playlist)
+        cached_index = self._playlist_indexes.get(playlist_id)
+
+        if cached_index is not None and cached_index[0] == snapshot_id:
+            return cached_index[2].copy()
+
+        known_snapshot = self._db_client.get_playlist_snapshot(playlist_id)
+
+        if known_snapshot is not None and known_snapshot[0] == snapshot_id:
+            track_ids = self._db_client.get_playlist_track_ids(playlist_id)
+            self._playlist_indexes[playlist_id] = (snapshot_id, known_snapshot[1], track_ids)
+
+            return track_ids.copy()
+
+        if known_snapshot is not None and known_snapshot[1] <= track_count:
+            offset = known_snapshot[1]
+            track_ids = self._db_client.get_playlist_track_ids(playlist_id)
+            replace = False
+        else:
+            offset = 0
+            track_ids = TrackArchive()
+            replace = True
+
+        new_track_ids = set()
+        tracks = self.get_all_playlist_tracks(playlist, fields='ids', offset=offset)
+
+        for track in tracks:
+            if track['track'] is not None and is_track_id(track['track']['id']):
+                new_track_ids.add(track['track']['id'])
+
+        track_count = offset + len(tracks)
+        self._db_client.add_playlist_tracks(playlist_id, new_track_ids, snapshot_id, track_count, replace=replace)
+        track_ids.update(new_track_ids)
+        self._playlist_indexes[playlist_id] = (snapshot_id, track_count, track_ids)
+
+        return track_ids.copy()
+
+    def get_merged_index(self, name, playlists):
+        """
+        Returns a single `TrackArchive` of the tracks in all of `playlists`, such as the shards of the destination
+        playlist, so that a track can be checked against all of them with one lookup.
+
+        The merged index is persisted under `name` along with the snapshot that the local index of each playlist was at
+        when it was merged. It is only rebuilt from the playlists' local indexes when one of them has changed since, so
+        the playlists are not queried and their indexes are not merged again on every run. Playlists that have never
+        been indexed are indexed first.
+
+        :param name:
+        :param playlists:
+        :return:
+        """
+        for playlist in playlists:
+            if self._db_client.get_playlist_snapshot(playlist['id']) is None:
+                self.get_playlist_index(playlist)
+
+        signature = self._get_merged_index_signature(playlists)
+        merged_index = self._db_client.get_merged_index(name)
+
+        if merged_index is not None and merged_index[0] == signature:
+            return merged_index[1]
+
+        archive = TrackArchive.union(self._db_client.get_playlist_track_ids(playlist['id']) for playlist in playlists)
+        self._db_client.set_merged_index(name, signature, archive)
+
+        return archive
+
+    def store_merged_index(self, name, playlists, archive):
+        """
+        Persists `archive` as the merged index of `playlists` under `name`, for example once the tracks identified
+        during a run have been added to the playlists, so the next run does not have to merge their indexes again.
+
+        :param name:
+        :param playlists:
+        :param archive:
+        """
+        self._db_client.set_merged_index(name, self._get_merged_index_signature(playlists), archive)
+
+    def _get_merged_index_signature(self, playlists):
+        """
+        Describes the state of the local indexes of `playlists` as the ID and last indexed `snapshot_id` of each.
+
+        :param playlists:
+        :return:
+        """
+        signature = []
+
+        for playlist in playlists:
+            known_snapshot = self._db_client.get_playlist_snapshot(playlist['id'])
+            signature.append([playlist['id'], known_snapshot[0] if known_snapshot is not None else None])
+
+        return json.dumps(signature)
 
     def add_tracks_to_playlist(self, tracks, playlist):
         """
@@ -265,18 +1029,155 @@ class SpotifyClient:
         added in a single request, therefore if more than 100 tracks are passed in the list is split up into chunks each
         containing a maximum of 100 tracks which are then sent to as multiple requests to the API.
 
+        Every chunk is recorded in a write journal before any are sent, and each is marked as written along with the
+        `snapshot_id` returned by the API as it completes. If the run is interrupted `resume_pending_writes` can then
+        finish the remaining chunks.
+
         :param tracks:
+        :param playlist:
+        """
+        if len(tracks) == 0:
+            return
+
+        playlist_id = playlist['id']
+        chunks = [tracks[i * 100:(i + 1) * 100] for i in range(math.ceil(len(tracks) / 100))]
+        known_snapshot = self._db_client.get_playlist_snapshot(playlist_id)
+        base_snapshot_id = known_snapshot[0] if known_snapshot is not None else None
+        self._db_client.journal_writes(playlist_id, chunks, base_snapshot_id)
+        self._flush_journal(playlist)
+
+    def _flush_journal(self, playlist):
+        """
+        Sends every journalled chunk for `playlist` that has not been written yet, in order, then clears the journal.
+
+        Adding tracks is not idempotent, so a write that fails after it may have reached the API is not simply sent
+        again. Instead the journal is reconciled against the playlist, as when resuming an interrupted run, before the
+        remaining chunks are retried. This is repeated up to the scheduler's maximum number of attempts.
+
+        If the API definitively rejects a chunk, for example because the playlist is full or not owned by the user, the
+        journal is cleared before the error is raised. Sending the same chunk again would be rejected in the same way,
+        so resuming it would only stop every later run at the same point. The tracks that were not added are not in the
+        playlist's index and are identified again by the next run.
+
         :param playlist:
         """
         playlist_id = playlist['id']
         endpoint = f'playlists/{playlist_id}/tracks'
-        iterations = math.ceil(len(tracks) / 100)
 
-        for i in range(iterations):
-            upper_limit = (i + 1) * 100
-            lower_limit = upper_limit - 100
-            track_uris = tracks[lower_limit:upper_limit]
-            data = {
-                'uris': track_uris
-            }
-            self._api_update_request(endpoint, data)
+        for attempt in range(self._scheduler.max_attempts):
+            if attempt > 0:
+                self._reconcile_journal(playlist)
+
+            try:
+                self._send_journal(playlist_id)
+                return
+            except UncertainWriteError as error:
+                self.log(f'{error}, checking the playlist before retrying')
+                self._backoff('POST', endpoint, attempt)
+            except SpotifyError as error:
+                if error.status_code is not None and 400 <= error.status_code < 500:
+                    self._db_client.clear_journal(playlist_id)
+
+                raise
+
+        raise SpotifyError(f'Adding tracks to playlist {playlist_id} failed after {self._scheduler.max_attempts} '
+                           f'attempts')
+
+    def _send_journal(self, playlist_id):
+        """
+        Sends the journalled chunks for `playlist_id` that have not been written yet, in order, then clears the journal.
+        As each chunk completes it is marked as written and its tracks are added to the playlist's local index together,
+        so an interruption can never leave the journal ahead of the index.
+
+        :param playlist_id:
+        """
+        endpoint = f'playlists/{playlist_id}/tracks'
+
+        for chunk_index, track_uris, _, snapshot_id in self._db_client.get_journal(playlist_id):
+            if snapshot_id is None:
+                data = {
+                    'uris': track_uris
+                }
+
+                with self.tracer.span('write_chunk', playlist_id=playlist_id, chunk=chunk_index,
+                                      tracks=len(track_uris)):
+                    response_data = self._api_update_request(endpoint, data)
+                    track_ids = [uri.split(':')[-1] for uri in track_uris]
+                    track_count = self._db_client.complete_journal_chunk(playlist_id, chunk_index,
+                                                                         response_data['snapshot_id'], track_ids)
+                    self._record_added_tracks(playlist_id, track_ids, response_data['snapshot_id'], track_count)
+
+        self._db_client.clear_journal(playlist_id)
+
+    def _reconcile_journal(self, playlist):
+        """
+        Checks the chunks left unwritten in the journal for `playlist` against the playlist itself, so that they can be
+        sent without adding any track twice. The number of tracks still to be added is returned.
+
+        The playlist is expected to be at the snapshot returned by the last chunk that was written, or at the snapshot
+        the writes were based on if none were written. If it is, the chunk that was interrupted cannot have been
+        applied and the remaining chunks are left as they are without checking the playlist's tracks. Otherwise it is
+        unknown whether the interrupted chunk was applied, so the remaining tracks are checked against the playlist's
+        index and the journal is replaced with only those that are missing.
+
+        :param playlist:
+        :return:
+        """
+        playlist_id = playlist['id']
+        journal = self._db_client.get_journal(playlist_id)
+        pending_chunks = [track_uris for _, track_uris, _, snapshot_id in journal if snapshot_id is None]
+
+        if len(pending_chunks) == 0:
+            self._db_client.clear_journal(playlist_id)
+            return 0
+
+        written_snapshots = [snapshot_id for _, _, _, snapshot_id in journal if snapshot_id is not None]
+        expected_snapshot_id = written_snapshots[-1] if len(written_snapshots) > 0 else journal[0][2]
+        snapshot_id, _ = self.get_playlist_snapshot(playlist)
+        pending_tracks = [track_uri for track_uris in pending_chunks for track_uri in track_uris]
+
+        if expected_snapshot_id is not None and snapshot_id == expected_snapshot_id:
+            return len(pending_tracks)
+
+        track_ids = self.get_playlist_index(playlist)
+        pending_tracks = [track_uri for track_uri in pending_tracks if track_uri.split(':')[-1] not in track_ids]
+        chunks = [pending_tracks[i * 100:(i + 1) * 100] for i in range(math.ceil(len(pending_tracks) / 100))]
+        self._db_client.clear_journal(playlist_id)
+
+        if len(chunks) > 0:
+            self._db_client.journal_writes(playlist_id, chunks, snapshot_id)
+
+        return len(pending_tracks)
+
+    def resume_pending_writes(self, playlist):
+        """
+        Finishes any writes to `playlist` left unfinished by an interrupted run and returns the number of tracks added.
+        The journal is first reconciled against the playlist so that tracks the interrupted run did add are not added
+        again.
+
+        :param playlist:
+        :return:
+        """
+        pending_tracks = self._reconcile_journal(playlist)
+
+        if pending_tracks > 0:
+            self._flush_journal(playlist)
+
+        return pending_tracks
+
+    def _record_added_tracks(self, playlist_id, track_ids, snapshot_id, track_count):
+        """
+        Appends tracks successfully added to `playlist_id` to the in-memory index of the playlist, once they have been
+        added to its local index along with the `snapshot_id` returned by the API and the playlist's new `track_count`.
+        If the playlist has never been indexed `track_count` is `None`, there is nothing to append to and the index is
+        left to be built on next use.
+
+        :param playlist_id:
+        :param track_ids:
+        :param snapshot_id:
+        :param track_count:
+        """
+        if track_count is not None and playlist_id in self._playlist_indexes:
+            cached_track_ids = self._playlist_indexes[playlist_id][2]
+            cached_track_ids.update(track_ids)
+            self._playlist_indexes[playlist_id] = (snapshot_id, track_count, cached_track_ids)
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+
+class Tracer:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._events = []
+        self._thread_names = {}
+        self._started_at = time.perf_counter()
+
+    def reset(self):
+        """
+        Discards every span recorded so far, so that a long running client can trace each run separately.
+        """
+        with self._lock:
+            self._events = []
+            self._thread_names = {}
+            self._started_at = time.perf_counter()
+
+    def span(self, name, **args):
+        """
+        Returns a context manager that records the time spent inside it as a span named `name`, with `args` attached to
+        the span. Spans opened inside another span on the same thread are nested within it. If the tracer is disabled
+        nothing is recorded.
+
+        :param name:
+        :param args:
+        :return:
+        """
+        if not self.enabled:
+            return nullcontext()
+
+        return self._span(name, args)
+
+    @contextmanager
+    def _span(self, name, args):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.perf_counter() - start, **args)
+
+    def add_span(self, name, start, duration, **args):
+        """
+        Records a span named `name` that started at `start`, a `time.perf_counter` value, and lasted `duration` seconds.
+        This is used for periods that are measured elsewhere, such as the time a request spent waiting on the scheduler.
+
+        :param name:
+        :param start:
+        :param duration:
+        :param args:
+        """
+        if not self.enabled:
+            return
+
+        thread = threading.current_thread()
+
+        with self._lock:
+            self._thread_names[thread.ident] = thread.name
+            self._events.append({
+                'name': name,
+                'ph': 'X',
+                'ts': (start - self._started_at) * 1000000,
+                'dur': duration * 1000000,
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'args': args
+            })
+
+    def to_dict(self):
+        """
+        Returns the recorded spans in the Chrome trace event format, which can be opened in `chrome://tracing` or
+        Perfetto. Each thread that recorded a span is labelled with its name.
+
+        :return:
+        """
+        with self._lock:
+            thread_names = [
+                {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                for tid, name in self._thread_names.items()
+            ]
+
+            return {
+                'traceEvents': thread_names + sorted(self._events, key=lambda event: event['ts']),
+                'displayTimeUnit': 'ms'
+            }
+
+    def write_json(self, path):
+        """
+        Writes the recorded spans to `path` as Chrome trace event JSON.
+
+        :param path:
+        """
+        Path(path).write_text(json.dumps(self.to_dict()))
+
+
+def profile(function, *args, sort='cumulative', limit=25):
+    """
+    Calls `function` with `args` under `cProfile` and prints the `limit` functions that took the most time, sorted by
+    `sort`. Only the calling thread is profiled. The value returned by `function` is returned.
+
+    :param function:
+    :param args:
+    :param sort:
+    :param limit:
+    :return:
+    """
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        pstats.Stats(profiler).strip_dirs().sort_stats(sort).print_stats(limit)
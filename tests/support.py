@@ -0,0 +1,60 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.benchmark_backup import seed_database
+from benchmarks.mock_spotify import MockSpotifyServer, MockSpotifyState
+from discoverindefinitely.backup import create_client
+
+
+class MockSpotifyTestCase(unittest.TestCase):
+    destination_size = 250
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.state = MockSpotifyState(self.destination_size)
+        self.server = MockSpotifyServer(self.state)
+        self.server.start()
+        self.db_path = Path(self.directory.name) / 'db.sqlite'
+        seed_database(self.db_path)
+        self.config = {
+            'client_id': 'client-id',
+            'client_secret': 'client-secret',
+            'destination_playlist': 'Backups',
+            'api_url': f'{self.server.url}v1/',
+            'accounts_url': self.server.url,
+            'database_path': str(self.db_path),
+            'requests_per_second': 1000
+        }
+        self.clients = []
+        self.client = self.create_client()
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+
+        self.server.stop()
+        self.directory.cleanup()
+
+    def create_client(self, scheduler=None, **config):
+        """
+        Creates a client for the mock API using the test's configuration updated with `config`. The client is closed
+        when the test finishes.
+
+        :param scheduler:
+        :param config:
+        :return:
+        """
+        client = create_client({**self.config, **config}, scheduler)
+        self.clients.append(client)
+
+        return client
+
+    def get_mock_playlist(self, name):
+        """
+        Returns the mock API's copy of the playlist named `name`.
+
+        :param name:
+        :return:
+        """
+        return next(playlist for playlist in self.state.playlists.values() if playlist['name'] == name)
@@ -0,0 +1,112 @@
+import random
+import unittest
+
+from benchmarks.mock_spotify import make_track_id
+from discoverindefinitely.archive import TrackArchive, decode_track_id, encode_track_id, is_track_id
+
+
+class TrackIdEncodingTest(unittest.TestCase):
+    def test_round_trip(self):
+        rng = random.Random(0)
+        track_ids = ['0' * 22, '7GhIk7Il098yCjg4BQjzvb'] + [make_track_id(rng) for _ in range(1000)]
+
+        for track_id in track_ids:
+            self.assertEqual(decode_track_id(encode_track_id(track_id)), track_id)
+
+    def test_keys_sort_in_track_id_order(self):
+        rng = random.Random(1)
+        track_ids = [make_track_id(rng) for _ in range(1000)]
+        keys = sorted(encode_track_id(track_id) for track_id in track_ids)
+
+        self.assertEqual([decode_track_id(key) for key in keys], sorted(track_ids))
+
+    def test_invalid_track_ids_are_rejected(self):
+        for track_id in ['', '7GhIk7Il098yCjg4BQjzv', '7GhIk7Il098yCjg4BQjzvbb', '7GhIk7Il098yCjg4BQjzv!', 'z' * 22,
+                         None]:
+            self.assertFalse(is_track_id(track_id))
+
+            with self.assertRaises(ValueError):
+                encode_track_id(track_id)
+
+        self.assertTrue(is_track_id('7GhIk7Il098yCjg4BQjzvb'))
+
+
+class TrackArchiveTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(2)
+        self.track_ids = [make_track_id(rng) for _ in range(2000)]
+
+    def test_update_matches_set(self):
+        archive = TrackArchive()
+        expected = set()
+
+        for start in range(0, len(self.track_ids), 300):
+            # Each batch overlaps the previous one so that duplicates are added as well.
+            batch = self.track_ids[max(start - 50, 0):start + 300]
+            archive.update(batch)
+            expected.update(batch)
+
+            self.assertEqual(len(archive), len(expected))
+            self.assertEqual(list(archive), sorted(expected))
+
+        self.assertNotIn(self.track_ids[0][::-1], archive)
+        self.assertNotIn('not a track ID', archive)
+        self.assertTrue(all(track_id in archive for track_id in self.track_ids))
+
+    def test_union_matches_set(self):
+        rng = random.Random(3)
+        archives = []
+        expected = set()
+
+        for _ in range(5):
+            track_ids = rng.sample(self.track_ids, 600)
+            archive = TrackArchive()
+            archive.update(track_ids)
+            archives.append(archive)
+            expected.update(track_ids)
+
+        union = TrackArchive.union(archives)
+
+        self.assertEqual(list(union), sorted(expected))
+        self.assertEqual(len(TrackArchive.union([])), 0)
+
+    def test_union_of_one_archive_is_a_copy(self):
+        archive = TrackArchive()
+        archive.update(self.track_ids[:10])
+        union = TrackArchive.union([archive])
+        union.add(self.track_ids[10])
+
+        self.assertEqual(len(archive), 10)
+        self.assertEqual(len(union), 11)
+
+    def test_merge_matches_set(self):
+        archive = TrackArchive()
+        archive.update(self.track_ids[:1200])
+        other = TrackArchive()
+        other.update(self.track_ids[800:])
+        archive.merge(other)
+
+        self.assertEqual(list(archive), sorted(self.track_ids))
+        self.assertEqual(len(other), len(self.track_ids) - 800)
+
+    def test_invalid_track_ids_leave_the_archive_unchanged(self):
+        archive = TrackArchive()
+        archive.update(self.track_ids[:10])
+
+        with self.assertRaises(ValueError):
+            archive.add('local-file')
+
+        with self.assertRaises(ValueError):
+            archive.update(self.track_ids[10:20] + ['local-file'])
+
+        self.assertEqual(list(archive), sorted(self.track_ids[:10]))
+
+    def test_bytes_round_trip(self):
+        archive = TrackArchive()
+        archive.update(self.track_ids)
+
+        self.assertEqual(list(TrackArchive(archive.to_bytes())), sorted(self.track_ids))
+
+
+if __name__ == '__main__':
+    unittest.main()
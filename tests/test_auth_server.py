@@ -0,0 +1,113 @@
+import socket
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+from discoverindefinitely.auth_server import AuthorisationServer
+from discoverindefinitely.spotify import SpotifyClient, SpotifyError
+
+
+class AuthorisationServerTest(unittest.TestCase):
+    def start_server(self, timeout=5):
+        server = AuthorisationServer(port=0, timeout=timeout)
+        server.start()
+
+        return server
+
+    def get(self, server, path):
+        """
+        Sends a GET request for `path` to `server` and returns the response's status code and body.
+
+        :param server:
+        :param path:
+        :return:
+        """
+        url = server.redirect_uri.replace('/callback', path)
+
+        try:
+            with urlopen(url, timeout=5) as response:
+                return response.status, response.read().decode()
+        except HTTPError as error:
+            return error.code, error.read().decode()
+
+    def wait(self, server):
+        """
+        Waits for `server` to finish and returns the access code along with anything it printed.
+
+        :param server:
+        :return:
+        """
+        output = StringIO()
+
+        with redirect_stdout(output):
+            auth_code = server.wait()
+
+        return auth_code, output.getvalue()
+
+    def test_ephemeral_port_is_used(self):
+        server = self.start_server(timeout=0)
+        port = urlparse(server.redirect_uri).port
+        self.wait(server)
+
+        self.assertNotEqual(port, 0)
+
+    def test_code_is_decoded_and_returned(self):
+        server = self.start_server()
+        status, message = self.get(server, '/callback?code=abc%2Fdef%3D&state=1')
+
+        self.assertEqual(status, 200)
+        self.assertIn('Authorisation complete', message)
+        self.assertEqual(self.wait(server), ('abc/def=', ''))
+
+    def test_declined_authorisation_ends_the_wait(self):
+        server = self.start_server()
+        start = time.perf_counter()
+        status, _ = self.get(server, '/callback?error=access_denied')
+        auth_code, output = self.wait(server)
+
+        self.assertEqual(status, 200)
+        self.assertIsNone(auth_code)
+        self.assertEqual(output, 'Authorisation failed: access_denied\n')
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_invalid_requests_do_not_end_the_wait(self):
+        server = self.start_server(timeout=0.2)
+
+        self.assertEqual(self.get(server, '/other?code=abc')[0], 404)
+        self.assertEqual(self.get(server, '/callback?state=1')[0], 400)
+        self.assertEqual(self.wait(server), (None, 'Timed out waiting for authorisation\n'))
+
+    def test_wait_times_out(self):
+        server = self.start_server(timeout=0.1)
+        start = time.perf_counter()
+
+        self.assertEqual(self.wait(server), (None, 'Timed out waiting for authorisation\n'))
+        self.assertLess(time.perf_counter() - start, 1)
+
+
+class AuthoriseTest(unittest.TestCase):
+    def test_port_in_use_raises(self):
+        with tempfile.TemporaryDirectory() as directory, socket.socket() as listener:
+            listener.bind(('localhost', 0))
+            listener.listen()
+            port = listener.getsockname()[1]
+            client = SpotifyClient('client-id', 'client-secret', database_path=Path(directory) / 'db.sqlite',
+                                   auth_port=port)
+
+            try:
+                with self.assertRaises(SpotifyError) as context:
+                    client._authorise()
+            finally:
+                client.close()
+
+        self.assertIn(f'could not listen on port {port}', str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
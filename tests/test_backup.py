@@ -0,0 +1,330 @@
+import json
+import random
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from discoverindefinitely import backup
+from discoverindefinitely.archive import TrackArchive
+from benchmarks.mock_spotify import MockSpotifyHandler, make_track_id
+from discoverindefinitely.backup import ConfigurationError, add_tracks_to_shards, create_scheduler, \
+    get_flushable_track_count, get_next_run, run_backup, validate_configuration
+from discoverindefinitely.metrics import RequestMetrics
+from discoverindefinitely.spotify import SpotifyError
+from tests.support import MockSpotifyTestCase
+
+
+class ValidateConfigurationTest(unittest.TestCase):
+    def setUp(self):
+        self.config = {
+            'client_id': 'client-id',
+            'client_secret': 'client-secret',
+            'destination_playlist': 'Backups'
+        }
+
+    def assert_invalid(self, **config):
+        with self.assertRaises(ConfigurationError):
+            validate_configuration({**self.config, **config})
+
+    def test_timeouts(self):
+        validate_configuration({**self.config, 'connect_timeout': 2, 'read_timeout': 7.5})
+
+        for value in [0, -1, '5', None, True]:
+            self.assert_invalid(connect_timeout=value)
+            self.assert_invalid(read_timeout=value)
+
+    def test_requests_per_second(self):
+        validate_configuration({**self.config, 'requests_per_second': 0.5})
+
+        for value in [0, -5, '5', None, False]:
+            self.assert_invalid(requests_per_second=value)
+
+    def test_authorisation_options(self):
+        validate_configuration({**self.config, 'auth_port': 0, 'auth_timeout': 30})
+        validate_configuration({**self.config, 'auth_port': 8081, 'auth_timeout': 0.5})
+
+        for value in [-1, 65536, '8080', 8080.0, None, True]:
+            self.assert_invalid(auth_port=value)
+
+        for value in [0, -1, '300', None, True]:
+            self.assert_invalid(auth_timeout=value)
+
+    def test_database_path(self):
+        validate_configuration({**self.config, 'database_path': 'accounts/alice.sqlite'})
+
+        for value in ['', 5, None, ['db.sqlite']]:
+            self.assert_invalid(database_path=value)
+
+
+class SourceBatchingTest(MockSpotifyTestCase):
+    def test_tracks_from_every_source_are_added_in_full_requests(self):
+        rng = random.Random(6)
+        source_names = []
+
+        for index in range(3):
+            self.state.add_playlist(f'Daily Mix {index + 1}', [make_track_id(rng) for _ in range(40)])
+            source_names.append(f'Daily Mix {index + 1}')
+
+        tracks_added = run_backup(self.client, {**self.config, 'source_playlists': source_names})
+        posts = [endpoint for endpoint in self.client.metrics.to_dict()['endpoints'] if endpoint['method'] == 'POST']
+
+        self.assertEqual(len(tracks_added), 120)
+        self.assertEqual(self.get_mock_playlist('Backups')['track_ids'][self.destination_size:],
+                         [track.split(':')[-1] for track in tracks_added])
+        self.assertEqual(posts[0]['requests'], 2)
+
+
+class GetFlushableTrackCountTest(unittest.TestCase):
+    def get_flushable_track_count(self, shard_track_count, track_count, max_playlist_size=10000):
+        client = mock.Mock()
+        client.get_playlist_track_count.return_value = shard_track_count
+
+        return get_flushable_track_count(client, [{'id': 'shard'}], track_count, max_playlist_size)
+
+    def test_only_full_requests_are_flushed(self):
+        self.assertEqual(self.get_flushable_track_count(0, 0), 0)
+        self.assertEqual(self.get_flushable_track_count(0, 99), 0)
+        self.assertEqual(self.get_flushable_track_count(0, 100), 100)
+        self.assertEqual(self.get_flushable_track_count(1234, 250), 200)
+
+    def test_tracks_that_fill_the_last_shard_are_flushed(self):
+        self.assertEqual(self.get_flushable_track_count(9950, 49), 0)
+        self.assertEqual(self.get_flushable_track_count(9950, 50), 50)
+        self.assertEqual(self.get_flushable_track_count(9950, 120), 50)
+        self.assertEqual(self.get_flushable_track_count(9950, 150), 150)
+
+    def test_tracks_that_fill_later_shards_are_flushed(self):
+        self.assertEqual(self.get_flushable_track_count(140, 400, max_playlist_size=150), 310)
+        self.assertEqual(self.get_flushable_track_count(150, 230, max_playlist_size=150), 150)
+
+
+class ShardTest(MockSpotifyTestCase):
+    def get_shard_track_ids(self):
+        """
+        Returns the number of tracks in each of the destination's shards in the mock API and a list of every track ID in
+        them.
+
+        :return:
+        """
+        shards = [playlist for playlist in self.state.playlists.values() if playlist['name'].startswith('Backups')]
+        sizes = {playlist['name']: len(playlist['track_ids']) for playlist in shards}
+
+        return sizes, [track_id for playlist in shards for track_id in playlist['track_ids']]
+
+    def get_new_track_ids(self):
+        source_track_ids = self.get_mock_playlist('Discover Weekly')['track_ids'] + \
+            self.get_mock_playlist('Release Radar')['track_ids']
+
+        return set(source_track_ids) - set(self.get_mock_playlist('Backups')['track_ids'])
+
+    def test_tracks_roll_over_to_a_new_shard(self):
+        new_track_ids = self.get_new_track_ids()
+        tracks_added = run_backup(self.client, {**self.config, 'max_playlist_size': 260})
+        sizes, track_ids = self.get_shard_track_ids()
+
+        self.assertEqual({track.split(':')[-1] for track in tracks_added}, new_track_ids)
+        self.assertEqual(sizes, {'Backups': 260, 'Backups 2': self.destination_size + len(new_track_ids) - 260})
+        self.assertEqual(len(track_ids), len(set(track_ids)))
+
+    def split_destination(self):
+        """
+        Splits the destination playlist in the mock API into shards of 100 tracks, as a backup with a
+        `max_playlist_size` of 100 would have left it.
+        """
+        destination = self.get_mock_playlist('Backups')
+
+        for shard_number, offset in enumerate(range(100, len(destination['track_ids']), 100), 2):
+            self.state.add_playlist(f'Backups {shard_number}', destination['track_ids'][offset:offset + 100])
+
+        del destination['track_ids'][100:]
+
+    def test_existing_shards_are_found_with_a_new_database(self):
+        new_track_ids = self.get_new_track_ids()
+        self.split_destination()
+        tracks_added = run_backup(self.client, {**self.config, 'max_playlist_size': 100})
+        sizes, track_ids = self.get_shard_track_ids()
+
+        self.assertEqual({track.split(':')[-1] for track in tracks_added}, new_track_ids)
+        self.assertEqual(sizes, {'Backups': 100, 'Backups 2': 100, 'Backups 3': 50 + len(new_track_ids)})
+        self.assertEqual(len(track_ids), len(set(track_ids)))
+
+    def test_tracks_already_in_an_unknown_shard_are_skipped(self):
+        backups = self.client.find_playlists(['Backups'])['Backups']
+        self.client.get_playlist_index(backups)
+        tracks = [f'spotify:track:{track_id}' for track_id in self.get_new_track_ids()]
+        self.state.add_playlist('Backups 2', [track.split(':')[-1] for track in tracks[10:20]])
+        shards = [backups]
+        destination_index = TrackArchive()
+        tracks_added = add_tracks_to_shards(self.client, tracks, shards, 'Backups', self.destination_size + 5,
+                                            destination_index)
+
+        self.assertEqual(tracks_added, tracks[:5] + tracks[5:10] + tracks[20:])
+        self.assertEqual(set(destination_index), {track.split(':')[-1] for track in tracks[10:20]})
+        self.assertEqual([shard['name'] for shard in shards], ['Backups', 'Backups 2'])
+        self.assertEqual(self.get_mock_playlist('Backups 2')['track_ids'][10:],
+                         [track.split(':')[-1] for track in tracks[5:10] + tracks[20:]])
+
+    def test_tracks_in_an_adopted_shard_are_not_added_again(self):
+        config = {**self.config, 'max_playlist_size': 300}
+        rng = random.Random(7)
+        run_backup(self.client, config)
+        existing_track_id = make_track_id(rng)
+        self.state.add_playlist('Backups 2', [existing_track_id])
+        self.get_mock_playlist('Discover Weekly')['track_ids'].extend(make_track_id(rng) for _ in range(10))
+        run_backup(self.client, config)
+        self.get_mock_playlist('Release Radar')['track_ids'].append(existing_track_id)
+
+        self.assertEqual(run_backup(self.client, config), [])
+        sizes, track_ids = self.get_shard_track_ids()
+        self.assertEqual(sizes, {'Backups': 300, 'Backups 2': 6})
+        self.assertEqual(len(track_ids), len(set(track_ids)))
+
+    def test_unchanged_run_cost_does_not_depend_on_the_number_of_shards(self):
+        self.split_destination()
+        config = {**self.config, 'max_playlist_size': 100}
+        run_backup(self.client, config)
+        self.state.reset_stats()
+
+        self.assertEqual(run_backup(self.client, config), [])
+        # Only the last shard and the two sources are retrieved, along with the tracks of the sources.
+        self.assertEqual(self.state.stats['endpoints'], {'playlists/{id}': 3, 'playlists/{id}/tracks': 2})
+
+
+class GetNextRunTest(unittest.TestCase):
+    # 12 October 2026 is a Monday.
+    schedule = {'days': ['monday'], 'time': '06:00'}
+
+    def test_later_the_same_day(self):
+        self.assertEqual(get_next_run(self.schedule, datetime(2026, 10, 12, 5, 59, 30)), datetime(2026, 10, 12, 6, 0))
+
+    def test_scheduled_time_has_passed(self):
+        self.assertEqual(get_next_run(self.schedule, datetime(2026, 10, 12, 6, 0)), datetime(2026, 10, 19, 6, 0))
+        self.assertEqual(get_next_run(self.schedule, datetime(2026, 10, 12, 23, 0)), datetime(2026, 10, 19, 6, 0))
+
+    def test_next_of_several_days(self):
+        schedule = {'days': ['Friday', 'monday'], 'time': '21:15'}
+
+        self.assertEqual(get_next_run(schedule, datetime(2026, 10, 13, 9, 0)), datetime(2026, 10, 16, 21, 15))
+        self.assertEqual(get_next_run(schedule, datetime(2026, 10, 16, 21, 16)), datetime(2026, 10, 19, 21, 15))
+
+    def test_across_a_month_end(self):
+        schedule = {'days': ['sunday'], 'time': '00:00'}
+
+        self.assertEqual(get_next_run(schedule, datetime(2026, 10, 26, 12, 0)), datetime(2026, 11, 1, 0, 0))
+
+
+class RunBatchTest(unittest.TestCase):
+    def test_schedulers_are_only_created_from_valid_configurations(self):
+        config = {
+            'client_id': 'client-id',
+            'client_secret': 'client-secret',
+            'destination_playlist': 'Backups'
+        }
+
+        with tempfile.TemporaryDirectory() as directory:
+            config['database_path'] = str(Path(directory, 'b.sqlite'))
+            Path(directory, 'a.json').write_text(json.dumps({**config, 'requests_per_second': '5'}))
+            Path(directory, 'b.json').write_text(json.dumps({**config, 'requests_per_second': 2}))
+
+            with mock.patch.object(backup, 'create_scheduler', wraps=create_scheduler) as scheduler_factory, \
+                    redirect_stdout(StringIO()):
+                summaries = backup.run_batch([directory])
+
+        scheduler_factory.assert_called_once_with({**config, 'requests_per_second': 2})
+        self.assertEqual(summaries[0]['error'], 'requests_per_second must be a positive number')
+        self.assertEqual(summaries[1]['status'], 'unauthorised')
+        self.assertNotIn('error', summaries[1])
+
+
+class RunAccountTest(MockSpotifyTestCase):
+    def run_account(self, config):
+        config_file = Path(self.directory.name, 'account.json')
+        config_file.write_text(json.dumps(config))
+
+        return backup.run_account(config_file, {config['client_id']: create_scheduler(config)})
+
+    def test_account_authorised_by_a_single_run_is_backed_up(self):
+        summary = self.run_account(self.config)
+
+        self.assertEqual(summary['status'], 'ok')
+        self.assertGreater(summary['tracks_added'], 0)
+
+    def test_messages_are_recorded_as_warnings(self):
+        config_file = Path(self.directory.name, 'account.json')
+        config_file.write_text(json.dumps({**self.config, 'source_playlists': ['Discover Weekly', 'Daily Mix 9']}))
+        output = StringIO()
+
+        with redirect_stdout(output):
+            summaries = backup.run_batch([config_file])
+
+        self.assertEqual(summaries[0]['status'], 'ok')
+        self.assertEqual(summaries[0]['warnings'], ['Source playlist Daily Mix 9 not found'])
+        self.assertIn(f'{config_file}: Source playlist Daily Mix 9 not found\n', output.getvalue())
+        self.assertEqual(output.getvalue().count('Daily Mix 9'), 1)
+
+    def test_database_path_is_required(self):
+        config = dict(self.config)
+        del config['database_path']
+        summary = self.run_account(config)
+
+        self.assertEqual(summary['status'], 'failed')
+        self.assertEqual(summary['error'], 'database_path must be set to back up an account in a batch')
+
+
+class CreateSchedulerTest(unittest.TestCase):
+    def test_budget_below_one_request_per_second_grants_a_request(self):
+        self.assertEqual(create_scheduler({'requests_per_second': 0.1}).acquire(), (0, 0))
+
+
+class RunBackupTest(MockSpotifyTestCase):
+    def test_cache_results_are_reported_per_run(self):
+        for _ in range(3):
+            # The daemon replaces the client's metrics before each run.
+            self.client.metrics = RequestMetrics()
+            run_backup(self.client, self.config)
+            report = self.client.metrics.to_dict()
+            get_requests = sum(endpoint['requests'] for endpoint in report['endpoints'] if endpoint['method'] == 'GET')
+
+            self.assertEqual(report['cache_hits'] + report['cache_misses'], get_requests)
+
+        self.assertGreater(report['cache_hits'], 0)
+
+    def test_rejected_write_does_not_block_later_runs(self):
+        destination = self.get_mock_playlist('Backups')
+        add_tracks = MockSpotifyHandler._post_playlists_id_tracks
+
+        def post_playlists_id_tracks(handler, path, query, data):
+            if path[1] == destination['id']:
+                return 403, {'error': {'status': 403, 'message': 'Forbidden'}}
+
+            return add_tracks(handler, path, query, data)
+
+        with mock.patch.object(MockSpotifyHandler, '_post_playlists_id_tracks', post_playlists_id_tracks):
+            with self.assertRaises(SpotifyError):
+                run_backup(self.client, self.config)
+
+            tracks_added = run_backup(self.client, {**self.config, 'max_playlist_size': self.destination_size})
+
+        self.assertEqual(len(destination['track_ids']), self.destination_size)
+        self.assertEqual(self.get_mock_playlist('Backups 2')['track_ids'],
+                         [track.split(':')[-1] for track in tracks_added])
+        self.assertGreater(len(tracks_added), 0)
+
+    def test_unrecognised_track_ids_are_skipped(self):
+        destination = self.get_mock_playlist('Backups')['track_ids']
+        destination.append('local-file')
+        self.get_mock_playlist('Release Radar')['track_ids'].insert(0, 'not-a-track-id')
+        source_track_ids = self.get_mock_playlist('Discover Weekly')['track_ids'] + \
+            self.get_mock_playlist('Release Radar')['track_ids']
+        expected_track_ids = set(source_track_ids) - set(destination) - {'not-a-track-id'}
+        tracks_added = run_backup(self.client, self.config)
+
+        self.assertEqual({track.split(':')[-1] for track in tracks_added}, expected_track_ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
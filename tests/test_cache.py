@@ -0,0 +1,74 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from discoverindefinitely.cache import ResponseCache
+from discoverindefinitely.database import DatabaseClient
+from tests.support import MockSpotifyTestCase
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_client = DatabaseClient(Path(self.directory.name) / 'db.sqlite')
+        self.decode = mock.Mock(side_effect=json.loads)
+
+    def tearDown(self):
+        self.db_client.close()
+        self.directory.cleanup()
+
+    def create_cache(self, decoded_size=2):
+        return ResponseCache(lambda: self.db_client, decode=self.decode, decoded_size=decoded_size)
+
+    def test_unchanged_response_is_not_decoded_again(self):
+        cache = self.create_cache()
+        decoded = cache.miss('a', '"1"', b'{"items": [1, 2]}')
+        cached_response = cache.get('a')
+
+        self.assertEqual(cached_response, ('"1"', None, decoded))
+        self.assertIs(cache.hit('a', cached_response), decoded)
+        self.assertEqual(self.decode.call_count, 1)
+
+    def test_responses_are_decoded_once_after_a_restart(self):
+        self.create_cache().miss('a', '"1"', b'{"items": [1, 2]}')
+        cache = self.create_cache()
+        cached_response = cache.get('a')
+
+        self.assertEqual(cached_response, ('"1"', b'{"items": [1, 2]}', None))
+
+        decoded = cache.hit('a', cached_response)
+
+        self.assertEqual(decoded, {'items': [1, 2]})
+        self.assertIs(cache.hit('a', cache.get('a')), decoded)
+        self.assertEqual(self.decode.call_count, 2)
+
+    def test_least_recently_used_bodies_are_evicted_from_memory(self):
+        cache = self.create_cache()
+
+        for key in ['a', 'b', 'c']:
+            cache.miss(key, '"1"', b'{}')
+
+        self.assertEqual(cache.get('a'), ('"1"', b'{}', None))
+        self.assertEqual(cache.get('c'), ('"1"', None, {}))
+
+    def test_responses_without_an_etag_are_not_cached(self):
+        cache = self.create_cache()
+
+        self.assertEqual(cache.miss('a', None, b'{}'), {})
+        self.assertIsNone(cache.get('a'))
+
+
+class CachedRequestTest(MockSpotifyTestCase):
+    def test_revalidated_response_is_reused(self):
+        first = self.client._api_query_request('me')
+        second = self.client._api_query_request('me')
+        report = self.client.metrics.to_dict()
+
+        self.assertIs(second, first)
+        self.assertEqual((report['cache_hits'], report['cache_misses']), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
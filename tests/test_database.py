@@ -0,0 +1,130 @@
+import random
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.mock_spotify import make_track_id
+from discoverindefinitely.database import DatabaseClient
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.directory.name) / 'db.sqlite'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_baseline_table(self, statement, rows):
+        """
+        Creates a table with `statement` in the database as an earlier version would have and fills it with `rows`.
+
+        :param statement:
+        :param rows:
+        """
+        connection = sqlite3.connect(self.db_path)
+        placeholders = ', '.join('?' for _ in rows[0])
+        table = statement.split()[2]
+
+        with connection:
+            connection.execute(statement)
+            connection.executemany(f'INSERT INTO {table} VALUES ({placeholders})', rows)
+
+        connection.close()
+
+    def get_tables(self):
+        """
+        Returns the names of the tables in the database.
+
+        :return:
+        """
+        connection = sqlite3.connect(self.db_path)
+        tables = {name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        connection.close()
+
+        return tables
+
+
+class ConfigurationTest(DatabaseTestCase):
+    def test_values_are_upserted(self):
+        db_client = DatabaseClient(self.db_path)
+
+        try:
+            db_client.set_many({'access_token': 'first', 'refresh_token': 'refresh'})
+            db_client.set_value('access_token', 'second')
+
+            self.assertEqual(db_client.get_many(['access_token', 'refresh_token', 'missing']),
+                             {'access_token': 'second', 'refresh_token': 'refresh'})
+            self.assertIsNone(db_client.get_value('missing'))
+        finally:
+            db_client.close()
+
+    def test_baseline_table_with_duplicate_keys_is_migrated(self):
+        self.create_baseline_table('CREATE TABLE configuration (key TEXT, value TEXT)', [
+            ('access_token', 'first'),
+            ('refresh_token', 'refresh'),
+            ('access_token', 'second')
+        ])
+        db_client = DatabaseClient(self.db_path)
+
+        try:
+            self.assertEqual(db_client.get_many(['access_token', 'refresh_token']),
+                             {'access_token': 'second', 'refresh_token': 'refresh'})
+
+            db_client.set_value('access_token', 'third')
+            self.assertEqual(db_client.get_value('access_token'), 'third')
+        finally:
+            db_client.close()
+
+        db_client = DatabaseClient(self.db_path)
+
+        try:
+            self.assertEqual(db_client.get_value('access_token'), 'third')
+        finally:
+            db_client.close()
+
+
+class PlaylistArchiveTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(4)
+        self.track_ids = [make_track_id(rng) for _ in range(250)]
+
+    def test_tracks_are_appended_and_replaced(self):
+        db_client = DatabaseClient(self.db_path)
+
+        try:
+            db_client.add_playlist_tracks('playlist', self.track_ids[:200], 'first', 200)
+            db_client.add_playlist_tracks('playlist', self.track_ids[150:], 'second', 250)
+
+            self.assertEqual(db_client.get_playlist_snapshot('playlist'), ('second', 250))
+            self.assertEqual(list(db_client.get_playlist_track_ids('playlist')), sorted(self.track_ids))
+
+            db_client.add_playlist_tracks('playlist', self.track_ids[:10], 'third', 10, replace=True)
+
+            self.assertEqual(list(db_client.get_playlist_track_ids('playlist')), sorted(self.track_ids[:10]))
+            self.assertEqual(len(db_client.get_playlist_track_ids('unknown')), 0)
+        finally:
+            db_client.close()
+
+    def test_baseline_playlist_tracks_table_is_migrated(self):
+        self.create_baseline_table('CREATE TABLE playlist_snapshots '
+                                   '(playlist_id TEXT PRIMARY KEY, snapshot_id TEXT, track_count INTEGER)',
+                                   [('playlist', 'snapshot', len(self.track_ids) + 1)])
+        self.create_baseline_table('CREATE TABLE playlist_tracks (playlist_id TEXT, track_id TEXT, '
+                                   'PRIMARY KEY (playlist_id, track_id)) WITHOUT ROWID',
+                                   [('playlist', track_id) for track_id in self.track_ids + ['local-file']])
+        db_client = DatabaseClient(self.db_path)
+
+        try:
+            self.assertEqual(db_client.get_playlist_snapshot('playlist'), ('snapshot', len(self.track_ids) + 1))
+            self.assertEqual(list(db_client.get_playlist_track_ids('playlist')), sorted(self.track_ids))
+        finally:
+            db_client.close()
+
+        self.assertNotIn('playlist_tracks', self.get_tables())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+import random
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+
+from benchmarks.mock_spotify import MockSpotifyHandler, make_track_id
+from discoverindefinitely.archive import TrackArchive
+from discoverindefinitely.spotify import RequestScheduler, SpotifyError
+from tests.support import MockSpotifyTestCase
+
+
+class JournalTestCase(MockSpotifyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.playlist = self.client.find_playlists(['Backups'])['Backups']
+        self.client.get_playlist_index(self.playlist)
+        self.destination = self.get_mock_playlist('Backups')
+
+        rng = random.Random(5)
+        self.new_track_ids = [make_track_id(rng) for _ in range(150)]
+        self.new_tracks = [f'spotify:track:{track_id}' for track_id in self.new_track_ids]
+        self.chunks = [self.new_tracks[:100], self.new_tracks[100:]]
+
+    def apply_chunk(self, chunk):
+        """
+        Adds the tracks in `chunk` to the mock API's copy of the destination playlist, as if a request had been applied
+        without its response reaching the client, and returns the playlist's new `snapshot_id`.
+
+        :param chunk:
+        :return:
+        """
+        with self.state.lock:
+            self.destination['track_ids'].extend(uri.split(':')[-1] for uri in chunk)
+            self.destination['version'] += 1
+            self.destination['snapshot_id'] = f'{self.destination["id"]}-{self.destination["version"]}'
+
+        return self.destination['snapshot_id']
+
+    def assert_backed_up_once(self):
+        track_ids = self.destination['track_ids']
+
+        self.assertEqual(len(track_ids), len(set(track_ids)))
+        self.assertEqual(track_ids[-len(self.new_track_ids):], self.new_track_ids)
+        self.assertEqual(self.client._db_client.get_journal(self.playlist['id']), [])
+        self.assertEqual(self.client.resume_pending_writes(self.playlist), 0)
+
+
+class ResumePendingWritesTest(JournalTestCase):
+    def test_snapshot_match(self):
+        # The first chunk was written and recorded, then the run stopped before sending the second.
+        self.client._db_client.journal_writes(self.playlist['id'], self.chunks, self.playlist['snapshot_id'])
+        snapshot_id = self.apply_chunk(self.chunks[0])
+        self.client._db_client.complete_journal_chunk(self.playlist['id'], 0, snapshot_id, self.new_track_ids[:100])
+
+        self.assertEqual(self.client.resume_pending_writes(self.playlist), len(self.chunks[1]))
+        self.assert_backed_up_once()
+
+    def test_snapshot_mismatch(self):
+        # The first chunk was applied by the API but the run stopped before the response was recorded.
+        self.client._db_client.journal_writes(self.playlist['id'], self.chunks, self.playlist['snapshot_id'])
+        self.apply_chunk(self.chunks[0])
+
+        self.assertEqual(self.client.resume_pending_writes(self.playlist), len(self.chunks[1]))
+        self.assert_backed_up_once()
+
+    def test_nothing_pending(self):
+        self.assertEqual(self.client.resume_pending_writes(self.playlist), 0)
+        self.assertEqual(len(self.destination['track_ids']), self.destination_size)
+
+    def test_resumed_tracks_are_indexed(self):
+        self.client._db_client.journal_writes(self.playlist['id'], self.chunks, self.playlist['snapshot_id'])
+        self.client.resume_pending_writes(self.playlist)
+        track_ids = self.client.get_playlist_index(self.playlist)
+
+        self.assertEqual(len(track_ids), self.destination_size + len(self.new_track_ids))
+        self.assertTrue(all(track_id in track_ids for track_id in self.new_track_ids))
+
+    def test_interrupted_chunk_completion_is_resumed(self):
+        # The run stops while the first chunk is being recorded, after the API applied it.
+        with mock.patch.object(TrackArchive, 'update', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.add_tracks_to_playlist(self.new_tracks, self.playlist)
+
+        client = self.create_client()
+
+        self.assertEqual(client.resume_pending_writes(self.playlist), len(self.chunks[1]))
+        self.assert_backed_up_once()
+
+        track_ids = client.get_playlist_index(self.playlist)
+
+        self.assertEqual(len(track_ids), self.destination_size + len(self.new_track_ids))
+        self.assertTrue(all(track_id in track_ids for track_id in self.new_track_ids))
+
+
+class AddTracksToPlaylistTest(JournalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = self.create_client(RequestScheduler(1000, 1000, max_attempts=3, backoff_base=0), read_timeout=0.5)
+        self.posts = []
+
+    def fail_posts(self, *failures):
+        """
+        Makes the mock API fail the first POSTs that add tracks, one for each of `failures`. A failure of `applied`
+        adds the tracks before responding with a server error, `rejected` responds with a server error without adding
+        them, `stalled` adds the tracks but does not respond before the client's read timeout and `forbidden` rejects
+        them with a client error. Every POST is recorded in `posts`.
+
+        :param failures:
+        :return:
+        """
+        add_tracks = MockSpotifyHandler._post_playlists_id_tracks
+        failures = list(failures)
+
+        def post_playlists_id_tracks(handler, path, query, data):
+            self.posts.append(data['uris'])
+            failure = failures.pop(0) if len(failures) > 0 else None
+            error = 500, {'error': {'status': 500, 'message': 'Internal server error'}}
+
+            if failure == 'rejected':
+                return error
+            elif failure == 'forbidden':
+                return 403, {'error': {'status': 403, 'message': 'Forbidden'}}
+
+            response = add_tracks(handler, path, query, data)
+
+            if failure == 'applied':
+                return error
+            elif failure == 'stalled':
+                time.sleep(1)
+
+            return response
+
+        return mock.patch.object(MockSpotifyHandler, '_post_playlists_id_tracks', post_playlists_id_tracks)
+
+    def add_tracks(self):
+        with redirect_stdout(StringIO()):
+            self.client.add_tracks_to_playlist(self.new_tracks, self.playlist)
+
+    def test_write_applied_before_failing_is_not_repeated(self):
+        with self.fail_posts('applied'):
+            self.add_tracks()
+
+        self.assert_backed_up_once()
+        self.assertEqual(self.posts, [self.chunks[0], self.chunks[1]])
+
+    def test_write_rejected_is_retried(self):
+        with self.fail_posts('rejected'):
+            self.add_tracks()
+
+        self.assert_backed_up_once()
+        self.assertEqual(self.posts, [self.chunks[0], self.chunks[0], self.chunks[1]])
+
+    def test_stalled_write_is_not_repeated(self):
+        with self.fail_posts('applied', 'stalled'):
+            self.add_tracks()
+
+        self.assert_backed_up_once()
+        self.assertEqual(self.posts, [self.chunks[0], self.chunks[1]])
+
+    def test_journal_is_kept_when_attempts_run_out(self):
+        with self.fail_posts('rejected', 'rejected', 'rejected'):
+            with self.assertRaises(SpotifyError):
+                self.add_tracks()
+
+        self.assertEqual(self.destination['track_ids'][self.destination_size:], [])
+        self.assertEqual(len(self.client._db_client.get_journal(self.playlist['id'])), 2)
+
+        self.assertEqual(self.client.resume_pending_writes(self.playlist), len(self.new_tracks))
+        self.assert_backed_up_once()
+
+    def test_rejected_write_is_abandoned(self):
+        with self.fail_posts('forbidden'):
+            with self.assertRaises(SpotifyError) as context:
+                self.add_tracks()
+
+        self.assertEqual(context.exception.status_code, 403)
+        self.assertEqual(self.posts, [self.chunks[0]])
+        self.assertEqual(self.client._db_client.get_journal(self.playlist['id']), [])
+        self.assertEqual(self.client.resume_pending_writes(self.playlist), 0)
+        self.assertEqual(self.posts, [self.chunks[0]])
+
+        # The tracks were not indexed, so a later run adds them.
+        track_ids = self.client.get_playlist_index(self.playlist)
+
+        self.assertFalse(any(track_id in track_ids for track_id in self.new_track_ids))
+
+        self.add_tracks()
+        self.assert_backed_up_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from discoverindefinitely.metrics import RequestMetrics, endpoint_template
+
+
+class EndpointTemplateTest(unittest.TestCase):
+    def test_ids_are_replaced(self):
+        self.assertEqual(endpoint_template('playlists/abc/tracks'), 'playlists/{id}/tracks')
+        self.assertEqual(endpoint_template('users/someone/playlists'), 'users/{id}/playlists')
+        self.assertEqual(endpoint_template('me/playlists'), 'me/playlists')
+
+
+class WritePrometheusTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / 'discoverindefinitely.prom'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_prometheus(self, metrics):
+        """
+        Writes `metrics` to the test's textfile and returns the sample values indexed by metric name and labels, along
+        with the type declared for each metric.
+
+        :param metrics:
+        :return:
+        """
+        metrics.write_prometheus(self.path)
+        samples = {}
+        types = {}
+
+        for line in self.path.read_text().splitlines():
+            if line.startswith('# TYPE '):
+                _, _, name, metric_type = line.split(' ')
+                types[name] = metric_type
+            else:
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+
+        return samples, types
+
+    def test_endpoint_metrics(self):
+        metrics = RequestMetrics()
+
+        for latency in [0.03, 0.3, 3, 20]:
+            metrics.record_request('GET', 'playlists/abc/tracks', 200, latency, 100)
+
+        metrics.record_request('GET', 'playlists/def/tracks', 429, 0.01, 10)
+        metrics.record_retry('GET', 'playlists/def/tracks')
+        metrics.record_sleep('GET', 'playlists/def/tracks', 'rate_limit', 1.5)
+        samples, types = self.write_prometheus(metrics)
+        labels = 'method="GET",endpoint="playlists/{id}/tracks"'
+        prefix = 'discoverindefinitely_'
+
+        self.assertEqual(types[f'{prefix}request_duration_seconds'], 'histogram')
+        self.assertEqual(types[f'{prefix}requests_total'], 'counter')
+        self.assertEqual(samples[f'{prefix}requests_total{{{labels},status="200"}}'], 4)
+        self.assertEqual(samples[f'{prefix}requests_total{{{labels},status="429"}}'], 1)
+        self.assertEqual(samples[f'{prefix}response_bytes_total{{{labels}}}'], 410)
+        self.assertEqual(samples[f'{prefix}retries_total{{{labels}}}'], 1)
+        self.assertEqual(samples[f'{prefix}sleep_seconds_total{{{labels},reason="rate_limit"}}'], 1.5)
+        self.assertEqual(samples[f'{prefix}sleep_seconds_total{{{labels},reason="backoff"}}'], 0)
+
+        # Histogram buckets are cumulative, with every request counted in the +Inf bucket.
+        buckets = {bucket: samples[f'{prefix}request_duration_seconds_bucket{{{labels},le="{bucket}"}}']
+                   for bucket in ['0.05', '0.5', '1', '5', '10', '+Inf']}
+
+        self.assertEqual(buckets, {'0.05': 2, '0.5': 3, '1': 3, '5': 4, '10': 4, '+Inf': 5})
+        self.assertEqual(samples[f'{prefix}request_duration_seconds_count{{{labels}}}'], 5)
+        self.assertAlmostEqual(samples[f'{prefix}request_duration_seconds_sum{{{labels}}}'], 23.34)
+
+    def test_run_gauges(self):
+        metrics = RequestMetrics()
+        metrics.record_cache_result(True)
+        metrics.set_run_info(tracks_added=5)
+        samples, types = self.write_prometheus(metrics)
+
+        self.assertEqual(samples['discoverindefinitely_run_tracks_added'], 5)
+        self.assertEqual(samples['discoverindefinitely_run_cache_hits'], 1)
+        self.assertEqual(samples['discoverindefinitely_run_cache_misses'], 0)
+        self.assertIn('discoverindefinitely_last_run_timestamp_seconds', samples)
+        self.assertEqual(types['discoverindefinitely_run_duration_seconds'], 'gauge')
+        self.assertEqual(list(Path(self.directory.name).iterdir()), [self.path])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from discoverindefinitely.spotify import RequestScheduler
+from tests.support import MockSpotifyTestCase
+
+
+class RequestSchedulerTest(unittest.TestCase):
+    def test_burst_is_granted_then_requests_are_paced(self):
+        scheduler = RequestScheduler(requests_per_second=20, burst=3)
+
+        for _ in range(3):
+            self.assertEqual(scheduler.acquire(), (0, 0))
+
+        start = time.monotonic()
+        rate_limited, paced = scheduler.acquire()
+
+        self.assertEqual(rate_limited, 0)
+        self.assertAlmostEqual(paced, 0.05, delta=0.02)
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_budget_is_shared_between_threads(self):
+        scheduler = RequestScheduler(requests_per_second=50, burst=1)
+        start = time.monotonic()
+        threads = [threading.Thread(target=scheduler.acquire) for _ in range(11)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_block_holds_back_every_request(self):
+        scheduler = RequestScheduler(requests_per_second=1000, burst=10)
+
+        with redirect_stdout(StringIO()):
+            scheduler.block(0.2)
+            # A shorter rate limit reported later does not shorten the first.
+            scheduler.block(0.05)
+
+        start = time.monotonic()
+        rate_limited, paced = scheduler.acquire()
+
+        self.assertAlmostEqual(rate_limited, 0.2, delta=0.05)
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+        self.assertLess(time.monotonic() - start, 0.3)
+
+    def test_backoff_is_capped(self):
+        scheduler = RequestScheduler(backoff_base=0.01, backoff_cap=0.02)
+
+        for attempt in range(10):
+            self.assertLessEqual(scheduler.backoff(attempt), 0.02)
+
+
+class RateLimitTest(MockSpotifyTestCase):
+    def test_rate_limited_requests_are_retried_after_waiting(self):
+        self.state.rate_limit_every = 2
+
+        with redirect_stdout(StringIO()) as output:
+            start = time.monotonic()
+            self.client._api_query_request('me')
+            self.client._api_query_request('me')
+
+        report = self.client.metrics.to_dict()['endpoints'][0]
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.9)
+        self.assertIn('Rate limited', output.getvalue())
+        self.assertEqual(report['status_codes'], {'200': 1, '304': 1, '429': 1})
+        self.assertEqual(report['retries'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,238 @@
+import random
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+from benchmarks.mock_spotify import make_track_id
+from discoverindefinitely.metrics import RequestMetrics
+from discoverindefinitely.spotify import RequestScheduler, SpotifyError, UncertainWriteError
+from tests.support import MockSpotifyTestCase
+
+
+class RequestTimeoutTest(MockSpotifyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = self.create_client(RequestScheduler(1000, 1000, max_attempts=2, backoff_base=0),
+                                         read_timeout=0.2)
+        self.state.latency = 1
+
+    def test_stalled_get_is_retried_then_fails(self):
+        start = time.perf_counter()
+
+        with self.assertRaises(SpotifyError) as context:
+            self.client._api_query_request('me')
+
+        self.assertIn('after 2 attempts', str(context.exception))
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_stalled_post_is_uncertain(self):
+        playlist = self.get_mock_playlist('Backups')
+
+        with self.assertRaises(UncertainWriteError):
+            self.client._api_update_request(f'playlists/{playlist["id"]}/tracks', {'uris': []})
+
+
+class TokenRefreshTest(MockSpotifyTestCase):
+    def test_rejected_refresh_raises(self):
+        self.state.expire_token_every = 1
+        self.state.refresh_token_revoked = True
+
+        with self.assertRaises(SpotifyError) as context:
+            self.client._api_query_request('me')
+
+        self.assertEqual(context.exception.status_code, 400)
+        self.assertIn('invalid_grant', str(context.exception))
+        self.assertEqual(self.state.stats['endpoints']['api/token'], 1)
+
+    def test_expired_token_is_refreshed(self):
+        self.state.expire_token_every = 2
+        self.client._api_query_request('me')
+        self.client._api_query_request('me')
+
+        self.assertEqual(self.state.stats['endpoints']['api/token'], 1)
+        self.assertEqual(self.state.stats['endpoints']['me'], 3)
+
+
+class FindPlaylistsTest(MockSpotifyTestCase):
+    def get_listing_requests(self):
+        return self.state.stats['endpoints'].get('me/playlists', 0)
+
+    def test_playlists_beyond_the_first_150_are_found(self):
+        for index in range(200):
+            self.state.add_playlist(f'Playlist {index}', [])
+
+        daily_mix = self.state.add_playlist('Daily Mix 1', [])
+        playlists = self.client.find_playlists(['Daily Mix 1', 'Backups'])
+
+        self.assertEqual(playlists['Daily Mix 1']['id'], daily_mix['id'])
+        self.assertEqual(playlists['Backups']['id'], self.get_mock_playlist('Backups')['id'])
+        self.assertEqual(self.get_listing_requests(), 5)
+
+        # Every playlist seen while paging through the listing is cached, so none of them are listed again.
+        self.state.reset_stats()
+        playlists = self.client.find_playlists(['Daily Mix 1', 'Playlist 150'])
+
+        self.assertEqual(set(playlists), {'Daily Mix 1', 'Playlist 150'})
+        self.assertEqual(self.get_listing_requests(), 0)
+
+    def test_listing_stops_once_every_name_is_found(self):
+        for index in range(200):
+            self.state.add_playlist(f'Playlist {index}', [])
+
+        self.assertEqual(set(self.client.find_playlists(['Backups', 'Release Radar'])), {'Backups', 'Release Radar'})
+        self.assertEqual(self.get_listing_requests(), 1)
+
+    def test_deleted_playlist_is_looked_up_again(self):
+        deleted_id = self.client.find_playlists(['Release Radar'])['Release Radar']['id']
+        del self.state.playlists[deleted_id]
+        release_radar = self.state.add_playlist('Release Radar', [])
+
+        self.assertEqual(self.client.find_playlists(['Release Radar'])['Release Radar']['id'], release_radar['id'])
+        self.assertEqual(self.client.get_known_playlist_ids(['Release Radar']), {'Release Radar': release_radar['id']})
+
+    def test_renamed_playlist_is_dropped_from_the_cache(self):
+        self.client.find_playlists(['Release Radar'])
+        self.get_mock_playlist('Release Radar')['name'] = 'Old Release Radar'
+
+        self.assertEqual(self.client.find_playlists(['Release Radar']), {})
+        self.assertEqual(self.client.get_known_playlist_ids(['Release Radar']), {})
+
+    def test_missing_name_is_found_once_a_playlist_is_renamed(self):
+        self.assertEqual(self.client.find_playlists(['Daily Mix 1']), {})
+
+        release_radar = self.get_mock_playlist('Release Radar')
+        release_radar['name'] = 'Daily Mix 1'
+
+        self.assertEqual(self.client.find_playlists(['Daily Mix 1'])['Daily Mix 1']['id'], release_radar['id'])
+
+    def test_missing_name_is_found_once_followed_in_place_of_another(self):
+        self.assertEqual(self.client.find_playlists(['Daily Mix 1']), {})
+
+        del self.state.playlists[self.get_mock_playlist('Release Radar')['id']]
+        daily_mix = self.state.add_playlist('Daily Mix 1', [])
+
+        self.assertEqual(self.client.find_playlists(['Daily Mix 1'])['Daily Mix 1']['id'], daily_mix['id'])
+
+    def test_unchanged_listing_is_answered_from_the_response_cache(self):
+        for index in range(100):
+            self.state.add_playlist(f'Playlist {index}', [])
+
+        self.client.find_playlists(['Daily Mix 1'])
+        self.client.metrics = RequestMetrics()
+
+        self.assertEqual(self.client.find_playlists(['Daily Mix 1']), {})
+        self.assertEqual(self.client.metrics.to_dict()['cache_misses'], 0)
+        self.assertEqual(self.client.metrics.to_dict()['cache_hits'], 3)
+
+
+class GetAllPlaylistTracksTest(MockSpotifyTestCase):
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(8)
+        self.track_ids = [make_track_id(rng) for _ in range(1050)]
+        self.playlist = self.state.add_playlist('Large', self.track_ids)
+        self.threads = set()
+        acquire = self.client._scheduler.acquire
+
+        def record_acquire():
+            self.threads.add(threading.current_thread())
+            return acquire()
+
+        self.acquire = mock.patch.object(self.client._scheduler, 'acquire', side_effect=record_acquire)
+        self.acquire.start()
+        self.addCleanup(self.acquire.stop)
+
+    def get_track_ids(self, **kwargs):
+        return [track['track']['id'] for track in self.client.get_all_playlist_tracks(self.playlist, 'ids', **kwargs)]
+
+    def test_pages_are_fetched_concurrently_in_playlist_order(self):
+        self.assertEqual(self.get_track_ids(), self.track_ids)
+        self.assertEqual(self.client._scheduler.acquire.call_count, 11)
+        self.assertGreater(len(self.threads), 1)
+        self.assertEqual(self.state.stats['endpoints']['playlists/{id}/tracks'], 11)
+
+    def test_tracks_from_an_offset(self):
+        self.assertEqual(self.get_track_ids(offset=130), self.track_ids[130:])
+        self.assertEqual(self.client._scheduler.acquire.call_count, 10)
+
+    def test_smaller_pages(self):
+        self.assertEqual(self.get_track_ids(offset=1000, limit=20), self.track_ids[1000:])
+        self.assertEqual(self.client._scheduler.acquire.call_count, 3)
+
+
+class PlaylistIndexTest(MockSpotifyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.destination = self.get_mock_playlist('Backups')
+        self.client.get_playlist_index(self.destination)
+
+    def set_tracks(self, track_ids):
+        """
+        Replaces the tracks of the mock API's copy of the destination playlist with `track_ids` and gives it a new
+        `snapshot_id`.
+
+        :param track_ids:
+        """
+        with self.state.lock:
+            self.destination['track_ids'] = list(track_ids)
+            self.destination['version'] += 1
+            self.destination['snapshot_id'] = f'{self.destination["id"]}-{self.destination["version"]}'
+
+    def get_playlist_index(self, client):
+        """
+        Indexes the destination playlist with `client` and returns the index along with the offset of every page of
+        tracks requested.
+
+        :param client:
+        :return:
+        """
+        with mock.patch.object(client, '_api_query_request', wraps=client._api_query_request) as query:
+            track_ids = client.get_playlist_index(self.destination)
+
+        offsets = [data['offset'] for (endpoint, data), _ in query.call_args_list if endpoint.endswith('/tracks')]
+
+        return track_ids, sorted(offsets)
+
+    def test_unchanged_playlist_is_read_locally(self):
+        track_ids, offsets = self.get_playlist_index(self.create_client())
+
+        self.assertEqual(offsets, [])
+        self.assertEqual(list(track_ids), sorted(self.destination['track_ids']))
+
+    def test_only_new_tracks_are_fetched(self):
+        rng = random.Random(9)
+        new_track_ids = [make_track_id(rng) for _ in range(120)]
+        self.set_tracks(self.destination['track_ids'] + new_track_ids)
+        track_ids, offsets = self.get_playlist_index(self.client)
+
+        self.assertEqual(offsets, [self.destination_size, self.destination_size + 100])
+        self.assertEqual(list(track_ids), sorted(self.destination['track_ids']))
+        self.assertEqual(self.client._db_client.get_playlist_snapshot(self.destination['id']),
+                         (self.destination['snapshot_id'], self.destination_size + 120))
+
+    def test_shrunk_playlist_is_fetched_again(self):
+        removed_track_ids = self.destination['track_ids'][:30]
+        self.set_tracks(self.destination['track_ids'][30:])
+        track_ids, offsets = self.get_playlist_index(self.create_client())
+
+        self.assertEqual(offsets, [0, 100, 200])
+        self.assertEqual(list(track_ids), sorted(self.destination['track_ids']))
+        self.assertFalse(any(track_id in track_ids for track_id in removed_track_ids))
+        self.assertEqual(list(self.client._db_client.get_playlist_track_ids(self.destination['id'])),
+                         sorted(self.destination['track_ids']))
+
+
+class ImportTest(unittest.TestCase):
+    def test_optional_json_decoder_is_not_imported_up_front(self):
+        result = subprocess.run([sys.executable, '-c', 'import sys, discoverindefinitely.backup; '
+                                                       'print("orjson" in sys.modules, "requests" in sys.modules)'],
+                                capture_output=True, text=True, check=True)
+
+        self.assertEqual(result.stdout.split(), ['False', 'False'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from discoverindefinitely.tracing import Tracer
+
+
+class TracerTest(unittest.TestCase):
+    def get_spans(self, trace):
+        return {event['name']: event for event in trace['traceEvents'] if event['ph'] == 'X'}
+
+    def test_nested_spans_are_written_as_trace_events(self):
+        tracer = Tracer()
+
+        with tracer.span('run', shards=2):
+            with tracer.span('dedup', tracks=10):
+                time.sleep(0.01)
+
+        worker = threading.Thread(target=lambda: tracer.add_span('write_chunk', time.perf_counter(), 0.002),
+                                  name='writer')
+        worker.start()
+        worker.join()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'trace.json'
+            tracer.write_json(path)
+            trace = json.loads(path.read_text())
+
+        spans = self.get_spans(trace)
+        run, dedup = spans['run'], spans['dedup']
+
+        self.assertEqual(trace['displayTimeUnit'], 'ms')
+        self.assertEqual(set(spans), {'run', 'dedup', 'write_chunk'})
+        self.assertEqual(run['args'], {'shards': 2})
+        self.assertEqual(dedup['args'], {'tracks': 10})
+        self.assertGreaterEqual(dedup['dur'], 10000)
+        self.assertLessEqual(run['ts'], dedup['ts'])
+        self.assertLessEqual(dedup['ts'] + dedup['dur'], run['ts'] + run['dur'])
+        self.assertEqual(run['tid'], dedup['tid'])
+        self.assertNotEqual(spans['write_chunk']['tid'], run['tid'])
+        self.assertAlmostEqual(spans['write_chunk']['dur'], 2000)
+
+        # Spans are ordered by start time after the thread name metadata of every thread that recorded one.
+        events = trace['traceEvents']
+        thread_names = {event['tid']: event['args']['name'] for event in events if event['ph'] == 'M'}
+
+        self.assertEqual(thread_names, {run['tid']: threading.current_thread().name,
+                                        spans['write_chunk']['tid']: 'writer'})
+        self.assertEqual([event['name'] for event in events if event['ph'] == 'X'], ['run', 'dedup', 'write_chunk'])
+
+    def test_disabled_tracer_records_nothing(self):
+        tracer = Tracer(enabled=False)
+
+        with tracer.span('run'):
+            tracer.add_span('write_chunk', time.perf_counter(), 1)
+
+        self.assertEqual(tracer.to_dict()['traceEvents'], [])
+
+    def test_reset_discards_spans(self):
+        tracer = Tracer()
+
+        with tracer.span('run'):
+            pass
+
+        tracer.reset()
+
+        self.assertEqual(tracer.to_dict()['traceEvents'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()